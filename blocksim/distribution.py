@@ -0,0 +1,353 @@
+import re
+from ast import literal_eval as make_tuple
+import numpy as np
+import scipy.stats
+from schema import Schema, SchemaError, Optional, Or
+
+# Number of random values drawn at once by each `RandomPool`
+DEFAULT_BUFFER_SIZE = 65536
+
+# Round trip time of each line of a ping log (e.g. `64 bytes from ...: icmp_seq=1 ttl=39 time=85.0 ms`)
+PING_TIME = re.compile(r'time=([0-9.]+) ms')
+
+
+def _norm(rng, loc, scale, n):
+    return rng.normal(loc, scale, n)
+
+
+def _lognorm(rng, s, loc, scale, n):
+    return loc + scale * rng.lognormal(0.0, s, n)
+
+
+def _invgamma(rng, a, loc, scale, n):
+    return loc + scale / rng.gamma(a, 1.0, n)
+
+
+def _beta(rng, a, b, loc, scale, n):
+    return loc + scale * rng.beta(a, b, n)
+
+
+def _expon(rng, loc, scale, n):
+    return loc + rng.exponential(scale, n)
+
+
+# NumPy `Generator` fast paths for the families used in the input parameters.
+# Each entry maps a SciPy distribution name to its sampler and to the number of
+# parameters it expects, following the SciPy order: (*shapes, loc, scale)
+NUMPY_SAMPLERS = {
+    'norm': (_norm, 2),
+    'lognorm': (_lognorm, 3),
+    'invgamma': (_invgamma, 3),
+    'beta': (_beta, 4),
+    'expon': (_expon, 2)
+}
+
+
+class Distribution:
+    """A probability distribution parsed and validated once, ready to be sampled.
+
+    Distributions in `NUMPY_SAMPLERS` are sampled directly with a NumPy `Generator`,
+    any other SciPy distribution is frozen and sampled through its `rvs`.
+
+    :param str name: the SciPy name of the distribution (e.g. norm or lognorm)
+    :param tuple parameters: the parameters of the distribution, as ``(*shapes, loc, scale)``
+    :param rng: the NumPy `Generator` used to draw the random values
+    """
+
+    __slots__ = ('name', 'parameters', '_rng', '_sampler', '_frozen')
+
+    def __init__(self, name: str, parameters: tuple, rng):
+        self.name = name
+        self.parameters = parameters
+        self._rng = rng
+        self._sampler = None
+        self._frozen = None
+        self._prepare()
+
+    def _prepare(self):
+        """Selects how the values are drawn, with NumPy or with the frozen SciPy distribution"""
+        if self.name in NUMPY_SAMPLERS:
+            self._sampler, _ = NUMPY_SAMPLERS[self.name]
+        else:
+            self._frozen = getattr(scipy.stats, self.name)(
+                *self.parameters[:-2], loc=self.parameters[-2], scale=self.parameters[-1])
+
+    def rvs(self, n=1):
+        """Returns an array with `n` random values"""
+        if self._frozen is not None:
+            return self._frozen.rvs(size=n, random_state=self._rng)
+        return self._sampler(self._rng, *self.parameters, n)
+
+    def mean(self):
+        """Returns the expected value of the distribution, without drawing any value"""
+        frozen = self._frozen or getattr(scipy.stats, self.name)(
+            *self.parameters[:-2], loc=self.parameters[-2], scale=self.parameters[-1])
+        return float(frozen.mean())
+
+    def __repr__(self):
+        return f'<{self.__class__.__name__}({self.name}{self.parameters})>'
+
+
+class EmpiricalDistribution(Distribution):
+    """A distribution built directly from the measurements taken, e.g. the round trip
+    times of a ping log.
+
+    The measurements are kept sorted and the values are drawn with the inverse of the
+    empirical CDF, interpolating linearly between consecutive measurements. If a kernel
+    `bandwidth` is given, the values are smoothed with a Gaussian kernel of that width and
+    clipped to be non negative.
+
+    :param str source: the file with the measurements
+    :param values: the sorted measurements
+    :param float bandwidth: the width of the Gaussian kernel, or 0 to disable the smoothing
+    :param rng: the NumPy `Generator` used to draw the random values
+    """
+
+    __slots__ = ('source', 'values', 'bandwidth')
+
+    def __init__(self, source: str, values, bandwidth: float, rng):
+        self.source = source
+        self.values = values
+        self.bandwidth = bandwidth
+        super().__init__('empirical', (bandwidth,), rng)
+
+    def _prepare(self):
+        """The values are drawn from the measurements, there is nothing to prepare"""
+
+    def rvs(self, n=1):
+        """Returns an array with `n` random values"""
+        positions = self._rng.random(n) * (len(self.values) - 1)
+        lower = positions.astype(np.intp)
+        upper = np.minimum(lower + 1, len(self.values) - 1)
+        values = self.values[lower] + \
+            (positions - lower) * (self.values[upper] - self.values[lower])
+        if self.bandwidth:
+            values = np.maximum(
+                values + self._rng.normal(0.0, self.bandwidth, n), 0.0)
+        return values
+
+    def mean(self):
+        return float(np.mean(self.values))
+
+    def __repr__(self):
+        return f'<{self.__class__.__name__}({self.source} bandwidth:{self.bandwidth})>'
+
+
+class RandomPool:
+    """A buffer of random values pre-drawn from a `Distribution`.
+
+    Values are consumed one at a time (`get`) or in blocks (`take`). When the buffer is
+    empty it is refilled with a single vectorized draw, and the `transform` (e.g. rounding
+    or unit conversion) is applied to the whole buffer at once.
+
+    A NumPy `Generator` gives the same values whether they are drawn one by one or in
+    bulk, so the values of a pool do not depend on its `size`.
+
+    :param distribution: the `Distribution` to draw the values from
+    :param int size: the number of values drawn on each refill
+    :param transform: an optional function applied to each array of values drawn
+    """
+
+    __slots__ = ('distribution', 'size', 'transform', '_buffer', '_values', '_position')
+
+    def __init__(self, distribution: Distribution, size=DEFAULT_BUFFER_SIZE, transform=None):
+        if size < 1:
+            raise ValueError(f'The size of a random pool must be positive, got {size}')
+        self.distribution = distribution
+        self.size = size
+        self.transform = transform
+        self._buffer = np.empty(0)
+        self._values = []
+        self._position = 0
+
+    def get(self):
+        """Returns the next random value as a `float`"""
+        if self._position == len(self._values):
+            self._refill()
+        value = self._values[self._position]
+        self._position += 1
+        return value
+
+    def take(self, n: int):
+        """Returns an array with the next `n` random values"""
+        chunks = []
+        while n > 0:
+            if self._position == len(self._values):
+                self._refill()
+            end = min(self._position + n, len(self._values))
+            chunks.append(self._buffer[self._position:end])
+            n -= end - self._position
+            self._position = end
+        if len(chunks) == 1:
+            return chunks[0]
+        return np.concatenate(chunks) if chunks else np.empty(0)
+
+    def _refill(self):
+        values = self.distribution.rvs(self.size)
+        if self.transform is not None:
+            values = self.transform(values)
+        self._buffer = values
+        self._values = values.tolist()
+        self._position = 0
+
+    def __repr__(self):
+        return f'<{self.__class__.__name__}({self.distribution!r} size:{self.size})>'
+
+
+class DistributionRegistry:
+    """Compiles the probability distributions given as simulation input.
+
+    Each distribution is represented as dictionary, with the following schema:
+    ``{ 'name': str, 'parameters': tuple as a string }``
+
+    Or, to sample the measurements of a file (e.g. a ping log) instead of a fitted
+    distribution, with the following schema:
+    ``{ 'name': 'empirical', 'source': str, 'bandwidth': float or 'auto' (optional) }``
+
+    The parameters string is parsed and validated only once per distribution. Every
+    compiled distribution draws from its own random stream, spawned from the `seed`,
+    so a simulation can be reproduced by running it again with the same seed.
+
+    :param int seed: the seed of the simulation, if None a random seed is used
+    :param int buffer_size: the number of values pre-drawn by each `RandomPool`
+    """
+
+    def __init__(self, seed=None, buffer_size=DEFAULT_BUFFER_SIZE):
+        self.buffer_size = buffer_size
+        self._seed_sequence = np.random.SeedSequence(seed)
+        # Generator for the random choices made outside of a distribution
+        self.rng = self.spawn_rng()
+        self._parsed = {}
+        self._measurements = {}
+
+    def spawn_rng(self):
+        """Returns a new NumPy `Generator` with an independent random stream"""
+        return np.random.default_rng(self._seed_sequence.spawn(1)[0])
+
+    def compile(self, distribution: dict) -> Distribution:
+        """Receives a `distribution` and returns a `Distribution` ready to be sampled"""
+        if isinstance(distribution, dict) and distribution.get('name') == 'empirical':
+            return self._compile_empirical(distribution)
+        name, parameters = self._parse(distribution)
+        return Distribution(name, parameters, self.spawn_rng())
+
+    def pool(self, distribution: dict, transform=None) -> RandomPool:
+        """Receives a `distribution` and returns a `RandomPool` of its values, with the
+        `transform` applied"""
+        return RandomPool(self.compile(distribution), self.buffer_size, transform)
+
+    def _compile_empirical(self, distribution: dict) -> EmpiricalDistribution:
+        self._validate(distribution)
+        source = distribution['source']
+        if source not in self._measurements:
+            self._measurements[source] = self._read_measurements(source)
+        values = self._measurements[source]
+        bandwidth = distribution.get('bandwidth', 0)
+        if bandwidth == 'auto':
+            # Silverman's rule of thumb
+            iqr = np.subtract(*np.percentile(values, [75, 25]))
+            spread = min(np.std(values), iqr / 1.34) or np.std(values)
+            bandwidth = 0.9 * spread * len(values) ** (-1 / 5)
+        return EmpiricalDistribution(source, values, float(bandwidth), self.spawn_rng())
+
+    def _read_measurements(self, source: str):
+        """Reads the measurements of a ping log, or of a file with one value per line,
+        and returns them sorted in a compact array"""
+        measurements = []
+        with open(source) as f:
+            for line in f:
+                match = PING_TIME.search(line)
+                if match:
+                    measurements.append(float(match.group(1)))
+                elif line.strip():
+                    try:
+                        measurements.append(float(line))
+                    except ValueError:
+                        continue
+        if not measurements:
+            raise ValueError(f'There are not measurements in {source}')
+        return np.sort(np.array(measurements, dtype=np.float32))
+
+    def _parse(self, distribution: dict):
+        self._validate(distribution)
+        key = (distribution['name'], distribution['parameters'])
+        if key in self._parsed:
+            return self._parsed[key]
+        name = distribution['name']
+        try:
+            parameters = tuple(float(p)
+                               for p in make_tuple(distribution['parameters']))
+        except (ValueError, SyntaxError, TypeError):
+            raise ValueError(
+                f'Invalid parameters for the {name} distribution: {distribution["parameters"]}')
+        if name in NUMPY_SAMPLERS:
+            _, num_parameters = NUMPY_SAMPLERS[name]
+            if len(parameters) != num_parameters:
+                raise ValueError(
+                    f'The {name} distribution expects {num_parameters} parameters, got {len(parameters)}')
+        elif not isinstance(getattr(scipy.stats, name, None), scipy.stats.rv_continuous):
+            raise ValueError(
+                f'Unknown probability distribution: {name}')
+        elif len(parameters) < 2:
+            raise ValueError(
+                f'The {name} distribution expects at least a loc and a scale, got {parameters}')
+        self._parsed[key] = (name, parameters)
+        return self._parsed[key]
+
+    def _validate(self, distribution: dict):
+        distribution_schema = Or(Schema({
+            'name': str,
+            'parameters': str
+        }), Schema({
+            'name': 'empirical',
+            'source': str,
+            Optional('bandwidth'): Or(int, float, 'auto')
+        }))
+        try:
+            distribution_schema.validate(distribution)
+        except SchemaError:
+            raise TypeError(
+                'Probability distribution must follow this schema: { \'name\': str, \'parameters\': tuple as a string } '
+                'or { \'name\': \'empirical\', \'source\': str, \'bandwidth\': float (optional) }')
+
+
+class DelayMatrix:
+    """The random pools measured between each pair of locations, indexed by location id.
+
+    ``matrix[origin, destination]`` gives the pool of a pair of locations, and `sample`
+    draws the values from one origin to many destinations in a single call.
+
+    :param list locations: the name of each location, its position in the list is the location id
+    :param list pools: a list of lists, where ``pools[origin][destination]`` is a `RandomPool`
+    """
+
+    __slots__ = ('locations', '_pools')
+
+    def __init__(self, locations: list, pools: list):
+        self.locations = locations
+        self._pools = pools
+
+    def __getitem__(self, key):
+        origin, destination = key
+        return self._pools[origin][destination]
+
+    def means(self):
+        """Returns a matrix with the expected value of each pair of locations, with the
+        transform of its pool applied"""
+        means = np.empty((len(self.locations), len(self.locations)))
+        for origin, row in enumerate(self._pools):
+            for destination, pool in enumerate(row):
+                mean = np.array([pool.distribution.mean()])
+                means[origin, destination] = (
+                    pool.transform(mean) if pool.transform is not None else mean)[0]
+        return means
+
+    def sample(self, origin: int, destinations):
+        """Returns an array with one random value for each location id in `destinations`"""
+        destinations = np.asarray(destinations, dtype=np.intp)
+        values = np.empty(len(destinations))
+        row = self._pools[origin]
+        for destination in np.unique(destinations):
+            mask = destinations == destination
+            values[mask] = row[destination].take(np.count_nonzero(mask))
+        return values
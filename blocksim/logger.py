@@ -0,0 +1,118 @@
+import sys
+from collections import deque
+from blocksim.utils import time
+
+DEBUG = 10
+INFO = 20
+WARNING = 30
+ERROR = 40
+OFF = 100
+
+LEVELS = {
+    'DEBUG': DEBUG,
+    'INFO': INFO,
+    'WARNING': WARNING,
+    'ERROR': ERROR,
+    'OFF': OFF
+}
+
+LEVEL_NAMES = {level: name for name, level in LEVELS.items()}
+
+# The subsystems of the simulator that log events, each one with its own level
+SUBSYSTEMS = ('network', 'chain', 'mempool', 'consensus')
+
+
+class SubsystemLogger:
+    """Logs the events of one subsystem of the simulator (e.g. network or chain).
+
+    Each event is given as the author (e.g. a node address), a message with ``%`` style
+    placeholders and its arguments. The message is only formatted if the level of the event
+    is enabled, so a disabled event costs a single comparison.
+
+    :param str name: the name of the subsystem
+    :param int level: the minimum level of the events written to the `stream`
+    :param ring: a `deque` shared by all the subsystems, to keep the last events, or None
+    :param int ring_level: the minimum level of the events kept in the `ring`
+    """
+
+    __slots__ = ('_env', 'name', 'level', '_threshold', '_ring', '_ring_level', '_stream')
+
+    def __init__(self, env, name: str, level: int, ring, ring_level: int, stream):
+        self._env = env
+        self.name = name
+        self.level = level
+        self._ring = ring
+        self._ring_level = ring_level
+        self._stream = stream
+        self._threshold = level if ring is None else min(level, ring_level)
+
+    def is_enabled_for(self, level: int):
+        return level >= self._threshold
+
+    def debug(self, who, msg: str, *args):
+        if DEBUG >= self._threshold:
+            self._log(DEBUG, who, msg, args)
+
+    def info(self, who, msg: str, *args):
+        if INFO >= self._threshold:
+            self._log(INFO, who, msg, args)
+
+    def warning(self, who, msg: str, *args):
+        if WARNING >= self._threshold:
+            self._log(WARNING, who, msg, args)
+
+    def error(self, who, msg: str, *args):
+        if ERROR >= self._threshold:
+            self._log(ERROR, who, msg, args)
+
+    def _log(self, level: int, who, msg: str, args: tuple):
+        if self._ring is not None and level >= self._ring_level:
+            self._ring.append((self._env.now, self.name, level, who, msg, args))
+        if level >= self.level:
+            print(f'{who} at {time(self._env)}: {msg % args}', file=self._stream)
+
+
+class SimulationLogger:
+    """Entry point of the logs of a simulation, with a `SubsystemLogger` for each one of the
+    `SUBSYSTEMS` (e.g. ``env.logger.chain.info(address, 'Adding block #%s', number)``).
+
+    :param env: the SimPy environment
+    :param dict levels: the level name of each subsystem, by default all are INFO
+    :param int ring_buffer_size: the number of last events kept in memory, to be dumped when
+        the simulation crashes. If 0, no events are kept
+    :param str ring_buffer_level: the minimum level of the events kept in memory
+    :param stream: where the events are written, by default the standard output
+    """
+
+    def __init__(self, env, levels=None, ring_buffer_size=0, ring_buffer_level='DEBUG', stream=None):
+        self._env = env
+        levels = levels or {}
+        unknown = set(levels) - set(SUBSYSTEMS)
+        if unknown:
+            raise ValueError(
+                f'Unknown log subsystems {sorted(unknown)}, available: {SUBSYSTEMS}')
+        self._ring = deque(maxlen=ring_buffer_size) if ring_buffer_size else None
+        stream = stream or sys.stdout
+        for subsystem in SUBSYSTEMS:
+            level = self._parse_level(levels.get(subsystem, 'INFO'))
+            setattr(self, subsystem, SubsystemLogger(
+                env, subsystem, level, self._ring, self._parse_level(ring_buffer_level), stream))
+
+    def dump(self, stream=None):
+        """Writes the events kept in memory, from the oldest to the newest"""
+        if self._ring is None:
+            return
+        stream = stream or sys.stderr
+        print(f'Last {len(self._ring)} events of the simulation:', file=stream)
+        for now, subsystem, level, who, msg, args in self._ring:
+            print(f'[{now:.4f} {subsystem} {LEVEL_NAMES.get(level, level)}] {who}: {msg % args}',
+                  file=stream)
+
+    def _parse_level(self, level):
+        if isinstance(level, int):
+            return level
+        try:
+            return LEVELS[level.upper()]
+        except (KeyError, AttributeError):
+            raise ValueError(
+                f'Unknown log level {level}, available: {list(LEVELS)}')
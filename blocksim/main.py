@@ -1,37 +1,38 @@
 import time
-import os
-from json import dumps as dump_json
 from blocksim.world import SimulationWorld
 from blocksim.node_factory import NodeFactory
 from blocksim.transaction_factory import TransactionFactory
 from blocksim.models.network import Network
+from blocksim.report import chain_segments
 
 
 def write_report(world):
-    path = 'output/report.json'
-    if not os.path.exists(path):
-        os.mkdir('output')
-        with open(path, 'w') as f:
-            pass
-    with open(path, 'w') as f:
-        f.write(dump_json(world.env.data))
+    world.env.data.update(world.env.metrics.report())
+    world.env.report.close(world.env.data)
 
 
 def report_node_chain(world, nodes_list):
+    """Reports the canonical chain of each node. The chains are split in segments shared
+    between the nodes, so the blocks where they agree are only reported once"""
+    chains = {node.address: node.chain.canonical_hashes for node in nodes_list}
+    nodes = {node.address: node for node in nodes_list}
+    segments, last_segments = chain_segments(chains)
+    # Any node with the chain of a segment can give its blocks
+    owners = {id(chain): address for address, chain in chains.items()}
+    report_segments = []
+    for segment in segments:
+        chain = nodes[owners[id(segment['chain'])]].chain
+        report_segments.append({
+            'parent': segment['parent'],
+            'first_block_number': segment['start'],
+            'blocks': [str(chain.get_header_by_number(number)) for number in range(segment['start'], segment['end'])]
+        })
+    world.env.data['chain_segments'] = report_segments
     for node in nodes_list:
-        head = node.chain.head
-        chain_list = []
-        num_blocks = 0
-        for i in range(head.header.number):
-            b = node.chain.get_block_by_number(i)
-            chain_list.append(str(b.header))
-            num_blocks += 1
-        chain_list.append(str(head.header))
         key = f'{node.address}_chain'
         world.env.data[key] = {
-            'head_block_hash': f'{head.header.hash[:8]} #{head.header.number}',
-            'number_of_blocks': num_blocks,
-            'chain_list': chain_list
+            **node.chain.summary(),
+            'last_segment': last_segments[node.address]
         }
 
 
@@ -70,22 +71,25 @@ def run_model():
         }
     }
 
-    node_factory = NodeFactory(world, network)
-    # Create all nodes
-    nodes_list = node_factory.create_nodes(miners, non_miners)
-    # Start the network heartbeat
-    world.env.process(network.start_heartbeat())
-    # Full Connect all nodes
-    for node in nodes_list:
-        node.connect(nodes_list)
+    try:
+        node_factory = NodeFactory(world, network)
+        # Create all nodes
+        nodes_list = node_factory.create_nodes(miners, non_miners)
+        # Start the network heartbeat
+        world.env.process(network.start_heartbeat())
+        # Connect the nodes with the topology configured
+        node_factory.connect_nodes(nodes_list)
 
-    transaction_factory = TransactionFactory(world)
-    transaction_factory.broadcast(100, 400, 15, nodes_list)
+        transaction_factory = TransactionFactory(world)
+        transaction_factory.broadcast(100, 400, 15, nodes_list)
 
-    world.start_simulation()
+        world.start_simulation()
 
-    report_node_chain(world, nodes_list)
-    write_report(world)
+        report_node_chain(world, nodes_list)
+        write_report(world)
+    finally:
+        # Release the databases, also when the simulation fails
+        world.close()
 
 
 if __name__ == '__main__':
@@ -0,0 +1,176 @@
+import math
+from collections import OrderedDict
+from blocksim.utils import short_hash
+
+# Relative accuracy of the quantiles given by a `QuantileSketch`
+DEFAULT_RELATIVE_ACCURACY = 0.01
+# Maximum number of objects sent and waiting to be received, for all the links
+MAX_PENDING = 100000
+# Quantiles included in the summary of each sketch
+SUMMARY_QUANTILES = (0.5, 0.9, 0.99)
+
+
+class QuantileSketch:
+    """A streaming histogram of positive values, with logarithmic bins, that answers
+    quantile queries with a bounded relative error (as in DDSketch).
+
+    Each bin ``i`` counts the values in ``(gamma^(i-1), gamma^i]``, with
+    ``gamma = (1 + accuracy) / (1 - accuracy)``, so any quantile is given with a relative
+    error of at most `accuracy`. Only the bins with values are kept, and their number grows
+    with the logarithm of the range of values, not with the number of values.
+
+    :param float accuracy: the relative accuracy of the quantiles
+    """
+
+    __slots__ = ('accuracy', '_gamma', '_log_gamma', 'bins', 'zeros', 'count', 'sum', 'min', 'max')
+
+    def __init__(self, accuracy=DEFAULT_RELATIVE_ACCURACY):
+        if not 0 < accuracy < 1:
+            raise ValueError(f'The accuracy of a sketch must be between 0 and 1, got {accuracy}')
+        self.accuracy = accuracy
+        self._gamma = (1 + accuracy) / (1 - accuracy)
+        self._log_gamma = math.log(self._gamma)
+        self.bins = {}
+        self.zeros = 0
+        self.count = 0
+        self.sum = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+
+    def add(self, value: float, count=1):
+        """Adds a `value` observed `count` times"""
+        if value > 0:
+            index = math.ceil(math.log(value) / self._log_gamma)
+            self.bins[index] = self.bins.get(index, 0) + count
+        else:
+            self.zeros += count
+        self.count += count
+        self.sum += value * count
+        if value < self.min:
+            self.min = value
+        if value > self.max:
+            self.max = value
+
+    def quantile(self, q: float):
+        """Returns the value at the quantile `q`, between 0 and 1"""
+        if self.count == 0:
+            return None
+        rank = q * (self.count - 1)
+        if rank < self.zeros:
+            return 0.0
+        seen = self.zeros
+        for index in sorted(self.bins):
+            seen += self.bins[index]
+            if seen > rank:
+                # The middle of the bin, in relative terms
+                value = 2 * self._gamma ** index / (self._gamma + 1)
+                return min(max(value, self.min), self.max)
+        return self.max
+
+    def histogram(self):
+        """Returns the bins with values as a list of ``[lower, upper, count]``"""
+        histogram = [[0.0, 0.0, self.zeros]] if self.zeros else []
+        for index in sorted(self.bins):
+            histogram.append(
+                [self._gamma ** (index - 1), self._gamma ** index, self.bins[index]])
+        return histogram
+
+    def summary(self):
+        summary = {
+            'count': self.count,
+            'mean': self.sum / self.count if self.count else None,
+            'min': self.min if self.count else None,
+            'max': self.max if self.count else None
+        }
+        for q in SUMMARY_QUANTILES:
+            summary[f'p{int(q * 100)}'] = self.quantile(q)
+        summary['histogram'] = self.histogram()
+        return summary
+
+
+class PropagationMetrics:
+    """Measures the propagation time of transactions and blocks, from the moment a node
+    broadcasts them to a peer until the peer receives them.
+
+    The propagation times are aggregated in a `QuantileSketch` for each pair of locations
+    (``granularity='location'``) or for each link between two nodes (``granularity='link'``),
+    so the memory used does not depend on the number of transactions or blocks simulated.
+    The objects sent and not yet received are kept in a bounded buffer of `MAX_PENDING`
+    entries, the oldest ones are discarded when it is full.
+
+    With `records` the propagation time of every object on every link is also written to
+    the ``tx_propagation_records`` and ``block_propagation_records`` streams of the `report`.
+
+    :param str granularity: how the propagation times are grouped, by location or by link
+    :param bool records: write the propagation time of every object to the `report`
+    :param report: the `ReportWriter` of the simulation, needed with `records`
+    :param float accuracy: the relative accuracy of the quantiles
+    """
+
+    def __init__(self, granularity='location', records=False, report=None,
+                 accuracy=DEFAULT_RELATIVE_ACCURACY, max_pending=MAX_PENDING):
+        if granularity not in ('location', 'link'):
+            raise ValueError(
+                f'Unknown propagation metrics granularity {granularity}, available: location or link')
+        if records and report is None:
+            raise ValueError('A report is needed to write the propagation records')
+        self.granularity = granularity
+        self.records = records
+        self.accuracy = accuracy
+        self.max_pending = max_pending
+        self._report = report
+        self._sketches = {'tx': {}, 'block': {}}
+        self._pending = OrderedDict()
+
+    def sent(self, kind: str, origin, destination, object_hash, now: float):
+        """Marks an object (`kind` is tx or block) as sent from `origin` to `destination`"""
+        key = (kind, origin.node_id, destination.node_id, object_hash)
+        if key in self._pending:
+            self._pending.move_to_end(key)
+        elif len(self._pending) >= self.max_pending:
+            self._pending.popitem(last=False)
+        self._pending[key] = now
+
+    def sent_many(self, kind: str, origin, destinations: list, object_hash, times: list):
+        """Marks an object as sent from `origin` to each one of the `destinations`, at the
+        given `times`"""
+        for destination, now in zip(destinations, times):
+            self.sent(kind, origin, destination, object_hash, now)
+
+    def received(self, kind: str, origin, destination, object_hash, now: float, object_hashes=None):
+        """Measures the propagation time of an object received (`kind` is tx or block).
+
+        Objects sent together, as the transactions of a batch, have the same propagation
+        time. Only the first one is marked as sent, and all of them are given in
+        `object_hashes` to be counted."""
+        initial_time = self._pending.pop(
+            (kind, origin.node_id, destination.node_id, object_hash), None)
+        if initial_time is None:
+            return
+        if object_hashes is None:
+            object_hashes = (object_hash,)
+        propagation_time = now - initial_time
+        self._sketch(kind, origin, destination).add(propagation_time, len(object_hashes))
+        if self.records:
+            link = f'{origin.address}_{destination.address}'
+            for h in object_hashes:
+                self._report.write(f'{kind}_propagation_records', {
+                    'link': link, 'hash': short_hash(h), 'propagation_time': propagation_time})
+
+    def _sketch(self, kind: str, origin, destination):
+        if self.granularity == 'location':
+            key = f'{origin.location}_{destination.location}'
+        else:
+            key = f'{origin.address}_{destination.address}'
+        sketches = self._sketches[kind]
+        sketch = sketches.get(key)
+        if sketch is None:
+            sketch = sketches[key] = QuantileSketch(self.accuracy)
+        return sketch
+
+    def report(self):
+        """Returns the summary of the propagation times, to be included in the report"""
+        return {
+            'tx_propagation': {key: sketch.summary() for key, sketch in self._sketches['tx'].items()},
+            'block_propagation': {key: sketch.summary() for key, sketch in self._sketches['block'].items()}
+        }
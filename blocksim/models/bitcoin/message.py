@@ -1,10 +1,68 @@
 from blocksim.utils import kB_to_MB
+from blocksim.models.message import NetworkMessage, VERSION, VERACK, INV, GETDATA, TX, BLOCK, NOTFOUND
+
+
+class VersionMessage(NetworkMessage):
+    __slots__ = ()
+
+    code = VERSION
+
+
+class VerackMessage(NetworkMessage):
+    __slots__ = ()
+
+    code = VERACK
+
+
+class InvMessage(NetworkMessage):
+    __slots__ = ('type', 'hashes')
+
+    code = INV
+
+    def __init__(self, hashes: list, _type: str, size: float):
+        super().__init__(size)
+        self.type = _type
+        self.hashes = hashes
+
+
+class GetDataMessage(InvMessage):
+    __slots__ = ()
+
+    code = GETDATA
+
+
+class NotFoundMessage(InvMessage):
+    __slots__ = ()
+
+    code = NOTFOUND
+
+
+class TxMessage(NetworkMessage):
+    __slots__ = ('tx',)
+
+    code = TX
+
+    def __init__(self, tx, size: float):
+        super().__init__(size)
+        self.tx = tx
+
+
+class BlockMessage(NetworkMessage):
+    __slots__ = ('block',)
+
+    code = BLOCK
+
+    def __init__(self, block, size: float):
+        super().__init__(size)
+        self.block = block
 
 
 class Message:
     """Defines a model for the network messages of the Bitcoin blockchain.
 
     For each message its calculated the size, taking into account measurements from the live and public network.
+    The messages without content (version and verack) are created once and shared, and
+    the sizes of the messages with a fixed size are calculated once, when the model is created.
     """
 
     def __init__(self, origin_node):
@@ -13,44 +71,32 @@ class Message:
         self._message_size = _env.config['bitcoin']['message_size_kB']
         # In bitcoin the header size has a fixed size https://en.bitcoin.it/wiki/Protocol_documentation#Message_structure
         self._header_size = self._message_size['header']
+        self._version = VersionMessage(kB_to_MB(self._header_size + self._message_size['version']))
+        self._verack = VerackMessage(kB_to_MB(self._header_size + self._message_size['verack']))
+        self._tx_size = kB_to_MB(self._header_size + self._message_size['tx'])
 
     def version(self):
         """ When a node creates an outgoing connection, it will immediately advertise its version.
         https://en.bitcoin.it/wiki/Protocol_documentation#version"""
-        return {
-            'id': 'version',
-            'size': kB_to_MB(self._header_size + self._message_size['version'])
-        }
+        return self._version
 
     def verack(self):
         """ The verack message is sent in reply to version. This message consists of only
         a message header with the command string "verack".
         https://en.bitcoin.it/wiki/Protocol_documentation#verack"""
-        return {
-            'id': 'verack',
-            'size': kB_to_MB(self._header_size + self._message_size['verack'])
-        }
+        return self._verack
 
     def inv(self, hashes: list, _type: str):
         """Allows a node to advertise its knowledge of one or more transactions or blocks
         https://en.bitcoin.it/wiki/Protocol_documentation#inv"""
         num_items = len(hashes)
         inv_size = num_items * self._message_size['inv_vector']
-        return {
-            'id': 'inv',
-            'type': _type,
-            'hashes': hashes,
-            'size': kB_to_MB(self._header_size + inv_size)
-        }
+        return InvMessage(hashes, _type, kB_to_MB(self._header_size + inv_size))
 
     def tx(self, tx):
-        """Sends a bitcoin transaction, in reply to getdata
+        """Sends a bitcoin transaction (a `TransactionBatch` with one transaction), in reply to getdata
         https://en.bitcoin.it/wiki/Protocol_documentation#tx"""
-        return {
-            'id': 'tx',
-            'tx': tx,
-            'size': kB_to_MB(self._header_size + self._message_size['tx'])
-        }
+        return TxMessage(tx, self._tx_size)
 
     def block(self, block):
         """Sends the body of a bitcoin block in response to a getdata message which
@@ -60,11 +106,7 @@ class Message:
         block_txs_size = self._message_size['tx'] * num_txs_block
         total_block_size = self._header_size + \
             self._message_size['block_base'] + block_txs_size
-        return {
-            'id': 'block',
-            'block': block,
-            'size': kB_to_MB(total_block_size)
-        }
+        return BlockMessage(block, kB_to_MB(total_block_size))
 
     def get_data(self, hashes: list, _type: str):
         """Used to retrieve the content of a specific type (e.g. block or transaction).
@@ -72,9 +114,12 @@ class Message:
         https://en.bitcoin.it/wiki/Protocol_documentation#getdata"""
         num_items = len(hashes)
         inv_size = num_items * self._message_size['inv_vector']
-        return {
-            'id': 'getdata',
-            'type': _type,
-            'hashes': hashes,
-            'size': kB_to_MB(self._header_size + inv_size)
-        }
+        return GetDataMessage(hashes, _type, kB_to_MB(self._header_size + inv_size))
+
+    def not_found(self, hashes: list, _type: str):
+        """A reply to getdata, with the items requested that are not available (e.g. blocks
+        that were finalized and removed)
+        https://en.bitcoin.it/wiki/Protocol_documentation#notfound"""
+        num_items = len(hashes)
+        inv_size = num_items * self._message_size['inv_vector']
+        return NotFoundMessage(hashes, _type, kB_to_MB(self._header_size + inv_size))
@@ -1,12 +1,13 @@
 from blocksim.models.node import Node
 from blocksim.models.network import Network
 from blocksim.models.bitcoin.message import Message
+from blocksim.models.message import VERSION, VERACK, INV, GETDATA, TX, BLOCK, NOTFOUND
 from blocksim.models.chain import Chain
-from blocksim.models.db import BaseDB
 from blocksim.models.consensus import Consensus
 from blocksim.models.transaction_queue import TransactionQueue
+from blocksim.models.transaction_batch import TransactionBatch
 from blocksim.models.block import Block, BlockHeader
-from blocksim.utils import time, get_random_values
+from blocksim.utils import get_random_values, short_hash
 
 
 class BTCNode(Node):
@@ -20,7 +21,7 @@ class BTCNode(Node):
         # Create the Bitcoin genesis block and init the chain
         genesis = Block(BlockHeader())
         consensus = Consensus(env)
-        chain = Chain(env, self, consensus, genesis, BaseDB())
+        chain = Chain(env, self, consensus, genesis, network.block_store())
         self.hashrate = hashrate
         self.is_mining = is_mining
         super().__init__(env,
@@ -31,6 +32,7 @@ class BTCNode(Node):
                          consensus)
         self.temp_txs = {}
         self.tx_on_transit = {}
+        self.blocks_on_transit = set()
         self.network_message = Message(self)
         if is_mining:
             # Transaction Queue to store the transactions
@@ -38,6 +40,29 @@ class BTCNode(Node):
                 env, self, self.consensus)
         self._know_version = []
         self._handshaking = env.event()
+        # Transactions hashes waiting to be announced to each peer, by peer address. A peer
+        # has a queue only while a trickle of announcements to it is scheduled
+        self._inv_queues = {}
+        self._trickle = env.config['bitcoin'].get('inv_trickle_interval', 0) > 0
+        # The handler of each type of message received, and of each type of inventory
+        # announced (`inv`) or requested (`getdata`)
+        self._handlers = {
+            VERSION: self._receive_version,
+            VERACK: self._receive_verack,
+            INV: lambda envelope: self._inv_handlers[envelope.msg.type](envelope),
+            GETDATA: lambda envelope: self._getdata_handlers[envelope.msg.type](envelope),
+            BLOCK: self._receive_full_block,
+            TX: self._receive_full_transaction,
+            NOTFOUND: self._receive_not_found
+        }
+        self._inv_handlers = {
+            'block': self._receive_new_inv_blocks,
+            'tx': self._receive_new_inv_transactions
+        }
+        self._getdata_handlers = {
+            'block': self._send_full_blocks,
+            'tx': self._send_full_transactions
+        }
 
     def build_new_block(self):
         """Builds a new candidate block and propagate it to the network
@@ -56,15 +81,12 @@ class BTCNode(Node):
             'bitcoin']['number_transactions_per_block']
         transactions_per_block = int(
             get_random_values(transactions_per_block_dist)[0])
-        pending_txs = []
-        for i in range(transactions_per_block * block_size):
-            if self.transaction_queue.is_empty():
-                break
-            pending_tx = self.transaction_queue.get()
-            pending_txs.append(pending_tx)
+        pending_txs = self.transaction_queue.get(
+            transactions_per_block * block_size)
         candidate_block = self._build_candidate_block(pending_txs)
-        print(
-            f'{self.address} at {time(self.env)}: New candidate block #{candidate_block.header.number} created {candidate_block.header.hash[:8]} with difficulty {candidate_block.header.difficulty}')
+        self.env.logger.consensus.info(
+            self.address, 'New candidate block #%s created %s with difficulty %s',
+            candidate_block.header.number, short_hash(candidate_block.header.hash), candidate_block.header.difficulty)
         # Add the candidate block to the chain of the miner node
         self.chain.add_block(candidate_block)
         # We need to broadcast the new candidate block across the network
@@ -89,24 +111,9 @@ class BTCNode(Node):
         """It implements how bitcon P2P protocol works, more info here:
         https://bitcoin.org/en/developer-reference#p2p-network"""
         super()._read_envelope(envelope)
-        if envelope.msg['id'] == 'version':
-            self._receive_version(envelope)
-        if envelope.msg['id'] == 'verack':
-            self._receive_verack(envelope)
-        if envelope.msg['id'] == 'inv':
-            if envelope.msg['type'] == 'block':
-                self._receive_new_inv_blocks(envelope)
-            if envelope.msg['type'] == 'tx':
-                self._receive_new_inv_transactions(envelope)
-        if envelope.msg['id'] == 'getdata':
-            if envelope.msg['type'] == 'block':
-                self._send_full_blocks(envelope)
-            if envelope.msg['type'] == 'tx':
-                self._send_full_transactions(envelope)
-        if envelope.msg['id'] == 'block':
-            self._receive_full_block(envelope)
-        if envelope.msg['id'] == 'tx':
-            self._receive_full_transaction(envelope)
+        handler = self._handlers.get(envelope.msg.code)
+        if handler is not None:
+            handler(envelope)
 
     ##              ##
     ## Handshake    ##
@@ -121,8 +128,8 @@ class BTCNode(Node):
         """When a node creates an outgoing connection, it will immediately advertise its version"""
         if destination_address not in self._know_version:
             version_msg = self.network_message.version()
-            print(
-                f'{self.address} at {time(self.env)}: Version message sent to {destination_address}')
+            self.env.logger.network.debug(
+                self.address, 'Version message sent to %s', destination_address)
             self._know_version.append(destination_address)
             self.env.process(self.send(destination_address, version_msg))
 
@@ -131,17 +138,18 @@ class BTCNode(Node):
         acceptance of the version. It also send his version to the destination, only if it
         was not send previously."""
         verack_msg = self.network_message.verack()
-        print(
-            f'{self.address} at {time(self.env)}: Version message received from {envelope.origin.address} and verack sent')
+        self.env.logger.network.debug(
+            self.address, 'Version message received from %s and verack sent', envelope.origin.address)
         self.env.process(self.send(envelope.origin.address, verack_msg))
-        print(f'{self.address} at {time(self.env)}: Send the response version to {envelope.origin.address}')
+        self.env.logger.network.debug(
+            self.address, 'Send the response version to %s', envelope.origin.address)
         self._send_version(envelope.origin.address)
 
     def _receive_verack(self, envelope):
         self._handshaking.succeed()
         self._handshaking = self.env.event()
-        print(
-            f'{self.address} at {time(self.env)}: Receive ACK from {envelope.origin.address}')
+        self.env.logger.network.debug(
+            self.address, 'Receive ACK from %s', envelope.origin.address)
 
     ##              ##
     ## Transactions ##
@@ -154,48 +162,91 @@ class BTCNode(Node):
         get_data_msg = self.network_message.get_data(hashes, 'tx')
         self.env.process(self.send(destination_address, get_data_msg))
 
-    def broadcast_transactions(self, transactions: list):
+    def broadcast_transactions(self, transactions: TransactionBatch):
         """Broadcast transactions to all nodes with an active session and mark the hashes
         as known by each node"""
         yield self.connecting  # Wait for all connections
+        if self._trickle:
+            self._trickle_transactions(transactions)
+            return
+        tx_hashes = transactions.hashes
         for node_address, node in self.active_sessions.items():
             transactions_hashes = []
-            for tx in transactions:
-                # Add the transaction to a temporary list
-                self.temp_txs[tx.hash] = tx
+            for i, tx_hash in enumerate(tx_hashes):
+                # Add the transaction to a temporary list, as the batch and its position
+                self.temp_txs[tx_hash] = (transactions, i)
                 # Checks if the transaction was previous sent
-                if any({tx.hash} & node.get('knownTxs')):
-                    print(
-                        f'{self.address} at {time(self.env)}: Transaction {tx.hash[:8]} was already sent to {node_address}')
+                if tx_hash in node.get('knownTxs'):
+                    self.env.logger.mempool.debug(
+                        self.address, 'Transaction %s was already sent to %s', short_hash(tx_hash), node_address)
                 else:
-                    self._mark_transaction(tx.hash, node_address)
-                    transactions_hashes.append(tx.hash)
+                    self._mark_transaction(tx_hash, node_address)
+                    transactions_hashes.append(tx_hash)
         # Only send if it has transactions hashes
         if transactions_hashes:
-            print(
-                f'{self.address} at {time(self.env)}: {len(transactions_hashes)} transaction(s) ready to be announced')
+            self.env.logger.mempool.debug(
+                self.address, '%s transaction(s) ready to be announced', len(transactions_hashes))
             transactions_msg = self.network_message.inv(
                 transactions_hashes, 'tx')
-            self.env.process(self.broadcast(transactions_msg))
+            self.broadcast(transactions_msg)
+
+    def _trickle_transactions(self, transactions: TransactionBatch):
+        """Queues the transactions to be announced to each peer that does not know them yet.
+
+        As in Bitcoin Core, the announcements to each peer are trickled: the queue of a peer is
+        sent as a single `inv` message after a random delay, drawn from an exponential
+        distribution with a mean of `inv_trickle_interval` seconds."""
+        tx_hashes = transactions.hashes
+        for i, tx_hash in enumerate(tx_hashes):
+            # Add the transaction to a temporary list, as the batch and its position
+            self.temp_txs[tx_hash] = (transactions, i)
+        for node_address, node in self.active_sessions.items():
+            known_txs = node['knownTxs']
+            announce = []
+            for tx_hash in tx_hashes:
+                if tx_hash in known_txs:
+                    self.env.logger.mempool.debug(
+                        self.address, 'Transaction %s was already sent to %s', short_hash(tx_hash), node_address)
+                else:
+                    self._mark_transaction(tx_hash, node_address)
+                    announce.append(tx_hash)
+            if not announce:
+                continue
+            queue = self._inv_queues.get(node_address)
+            if queue is None:
+                self._inv_queues[node_address] = announce
+                trickle = self.env.timeout(self.env.delays['inv_trickle'].get(), node_address)
+                trickle.callbacks.append(self._send_inv_queue)
+            else:
+                queue.extend(announce)
+
+    def _send_inv_queue(self, trickle):
+        node_address = trickle.value
+        transactions_hashes = self._inv_queues.pop(node_address)
+        self.env.logger.mempool.debug(
+            self.address, '%s transaction(s) announced to %s', len(transactions_hashes), node_address)
+        transactions_msg = self.network_message.inv(transactions_hashes, 'tx')
+        self.env.process(self.send(node_address, transactions_msg))
 
     def _send_full_transactions(self, envelope):
         """Send a full transaction for any node that request it, identified by the
-        `destination_address`. In `envelope.msg['hashes']` we obtain a list of hashes of
+        `destination_address`. In `envelope.msg.hashes` we obtain a list of hashes of
         transactions being requested
         """
-        for tx_hash in envelope.msg['hashes']:
+        for tx_hash in envelope.msg.hashes:
             if tx_hash in self.temp_txs:
-                tx = self.temp_txs[tx_hash]
+                transactions, i = self.temp_txs[tx_hash]
+                tx = transactions[i]
                 del self.temp_txs[tx_hash]
-                print(
-                    f'{self.address} at {time(self.env)}: Full transaction {tx.hash[:8]} preapred to send')
+                self.env.logger.mempool.debug(
+                    self.address, 'Full transaction %s prepared to send', short_hash(tx_hash))
                 tx_msg = self.network_message.tx(tx)
                 self.env.process(self.send(envelope.origin.address, tx_msg))
 
     def _receive_new_inv_transactions(self, envelope):
         """Handle new transactions received"""
         request_txs = []
-        for tx_hash in envelope.msg.get('hashes'):
+        for tx_hash in envelope.msg.hashes:
             # Only request full TX that are not on transit
             if tx_hash not in self.tx_on_transit:
                 request_txs.append(tx_hash)
@@ -205,55 +256,106 @@ class BTCNode(Node):
 
     def _receive_full_transaction(self, envelope):
         """Handle full tx received. If node is miner store transactions in a pool"""
-        tx = envelope.msg.get('tx')
-        del self.tx_on_transit[tx.hash]
+        tx = envelope.msg.tx
+        del self.tx_on_transit[tx.hashes[0]]
         if self.is_mining:
             self.transaction_queue.put(tx)
-        self.env.process(self.broadcast_transactions([tx]))
+        if self._trickle:
+            self._trickle_transactions(tx)
+        else:
+            self.env.process(self.broadcast_transactions(tx))
 
     ##              ##
     ## Blocks       ##
     ##              ##
 
     def broadcast_new_blocks(self, new_blocks: list):
-        """Specify one or more new blocks which have appeared on the network."""
+        """Specify one or more new blocks which have appeared on the network. The blocks
+        are only announced to the peers that do not know them yet."""
         new_blocks_hashes = [b.header.hash for b in new_blocks]
+        addresses = self._announce_blocks(new_blocks_hashes)
+        if not addresses:
+            return
         new_blocks_msg = self.network_message.inv(new_blocks_hashes, 'block')
-        self.env.process(self.broadcast(new_blocks_msg))
+        self.broadcast(new_blocks_msg, addresses)
 
     def _receive_new_inv_blocks(self, envelope):
         """Handle new `inv` blocks received (https://bitcoin.org/en/developer-reference#inv).
         The destination only receives the hash of the block, and then ask for the entire block
         by calling `getdata` netowork protocol message (https://bitcoin.org/en/developer-reference#getdata)."""
-        new_blocks_hashes = envelope.msg.get('hashes')
-        print(
-            f'{self.address} at {time(self.env)}: {len(new_blocks_hashes)} new blocks announced by {envelope.origin.address}')
-        get_data_msg = self.network_message.get_data(
-            new_blocks_hashes, 'block')
-        self.env.process(
-            self.send(envelope.origin.address, get_data_msg))
+        new_blocks_hashes = envelope.msg.hashes
+        self.env.logger.network.debug(
+            self.address, '%s new blocks announced by %s', len(new_blocks_hashes), envelope.origin.address)
+        # Only request the blocks that are not known or on transit
+        request_blocks = []
+        for block_hash in new_blocks_hashes:
+            self._mark_block(block_hash, envelope.origin.address)
+            if self.chain.get_block(block_hash) is None and block_hash not in self.blocks_on_transit \
+                    and block_hash not in self.chain.orphans:
+                request_blocks.append(block_hash)
+        if request_blocks:
+            self.request_blocks(request_blocks, envelope.origin.address)
+
+    def request_blocks(self, hashes: list, destination_address: str):
+        """Request full blocks to a specific node by `destination_address`"""
+        self.blocks_on_transit.update(hashes)
+        get_data_msg = self.network_message.get_data(hashes, 'block')
+        self.env.process(self.send(destination_address, get_data_msg))
 
     def _send_full_blocks(self, envelope):
         """Send a full block (https://bitcoin.org/en/developer-reference#block) for any node that
         request it (`envelope.origin.address`) by using `getdata`.
-        In `envelope.msg['hashes']` we obtain a list of hashes of full blocks being requested
+        In `envelope.msg.hashes` we obtain a list of hashes of full blocks being requested
         """
         origin = envelope.origin.address
-        for block_hash in envelope.msg['hashes']:
+        not_found = []
+        for block_hash in envelope.msg.hashes:
             block = self.chain.get_block(block_hash)
-            print(
-                f'{self.address} at {time(self.env)}: Block {block.header.hash[:8]} preapred to send to {origin}')
+            if block is None:
+                not_found.append(block_hash)
+                continue
+            self.env.logger.network.debug(
+                self.address, 'Block %s prepared to send to %s', short_hash(block.header.hash), origin)
             block_msg = self.network_message.block(block)
             self.env.process(self.send(origin, block_msg))
+        # The blocks that are not available (e.g. finalized and removed) are reported as such
+        if not_found:
+            not_found_msg = self.network_message.not_found(not_found, 'block')
+            self.env.process(self.send(origin, not_found_msg))
+
+    def _receive_not_found(self, envelope):
+        """Handle `notfound` received, the blocks requested can be requested again to another peer"""
+        if envelope.msg.type == 'block':
+            self.blocks_on_transit.difference_update(envelope.msg.hashes)
 
     def _receive_full_block(self, envelope):
         """Handle full blocks received.
-        The node tries to add the block to the chain, by performing validation."""
-        block = envelope.msg['block']
+        The node tries to add the block to the chain, by performing validation. A block added
+        is announced to the peers that do not know it, and the parent of a block that is
+        unknown is requested to the peer that sent it."""
+        block = envelope.msg.block
+        origin = envelope.origin.address
+        self._mark_block(block.header.hash, origin)
+        self.blocks_on_transit.discard(block.header.hash)
+        if self.chain.get_block(block.header.hash) is not None:
+            return
         is_added = self.chain.add_block(block)
         if is_added:
-            print(
-                f'{self.address} at {time(self.env)}: Block assembled and added to the tip of the chain {block.header}')
+            self.env.logger.chain.info(
+                self.address, 'Block assembled and added to the tip of the chain %s', block.header)
+            self._relay_block(block)
         else:
-            print(
-                f'{self.address} at {time(self.env)}: Block NOT added to the chain {block.header}')
+            self.env.logger.chain.info(
+                self.address, 'Block NOT added to the chain %s', block.header)
+            prevhash = block.header.prevhash
+            if block.header.hash in self.chain.orphans and prevhash not in self.blocks_on_transit \
+                    and prevhash not in self.chain.orphans:
+                self.request_blocks([prevhash], origin)
+
+    def _relay_block(self, block):
+        """Announces a block added to the chain, and the head of the chain when it changed to
+        another block (e.g. an orphan block connected by it)"""
+        self.broadcast_new_blocks([block])
+        head = self.chain.head
+        if head.header.hash != block.header.hash:
+            self.broadcast_new_blocks([head])
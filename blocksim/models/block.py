@@ -1,6 +1,7 @@
 import time
 from datetime import datetime
-from blocksim.utils import keccak_256, encode_hex
+from blocksim.utils import encode_hex, short_hash
+from blocksim.models import identity
 
 
 class BlockHeader:
@@ -14,8 +15,18 @@ class BlockHeader:
     :param str coinbase: coinbase address of the block miner, in this simulation we include the node address
     :param int difficulty: the blocks difficulty
     :param str nonce: a nonce constituting a Proof-of-Work
+
+    A block header is immutable after being created, so its hash is calculated once, when it is constructed.
+With synthetic ids, headers are therefore numbered in the order they are created.
     """
 
+    __slots__ = ('prevhash', 'number', 'timestamp',
+                 'coinbase', 'difficulty', 'nonce', '_hash')
+
+    # The fields included in the canonical encoding of the header
+    _fields = ('prevhash', 'number', 'timestamp',
+               'coinbase', 'difficulty', 'nonce')
+
     def __init__(self,
                  prevhash=encode_hex(b'\x00' * 32),
                  number=0,
@@ -23,17 +34,39 @@ class BlockHeader:
                  coinbase=encode_hex(b'\x00' * 20),
                  difficulty=100000,
                  nonce=''):
-        self.prevhash = prevhash
-        self.number = number
-        self.timestamp = timestamp
-        self.coinbase = coinbase
-        self.difficulty = difficulty
-        self.nonce = nonce
+        _set = object.__setattr__
+        _set(self, 'prevhash', prevhash)
+        _set(self, 'number', number)
+        _set(self, 'timestamp', timestamp)
+        _set(self, 'coinbase', coinbase)
+        _set(self, 'difficulty', difficulty)
+        _set(self, 'nonce', nonce)
+        _set(self, '_hash', identity.block_id(self))
 
     @property
     def hash(self):
-        """The block header hash"""
-        return encode_hex(keccak_256(str(self).encode('utf-8')))
+        """The block header hash, calculated when the header is created.
+        It is an integer when the simulation uses synthetic ids"""
+        return self._hash
+
+    def encode(self):
+        """Returns the canonical byte encoding of the block header"""
+        values = [self.__class__.__name__]
+        values.extend(str(getattr(self, field)) for field in self._fields)
+        return '|'.join(values).encode('utf-8')
+
+    def __setattr__(self, name, value):
+        raise AttributeError(
+            f'{self.__class__.__name__} is immutable, cannot set {name}')
+
+    def __delattr__(self, name):
+        raise AttributeError(
+            f'{self.__class__.__name__} is immutable, cannot delete {name}')
+
+    def __setstate__(self, state):
+        _, slots = state
+        for name, value in slots.items():
+            object.__setattr__(self, name, value)
 
     def __repr__(self):
         """Returns a unambiguous representation of the block header"""
@@ -43,7 +76,7 @@ class BlockHeader:
         """Returns a readable representation of the block"""
         timestamp = datetime.utcfromtimestamp(
             self.timestamp).strftime('%m-%d %H:%M:%S')
-        return f'<{self.__class__.__name__}(#{self.number} prevhash:{self.prevhash[:8]} timestamp:{timestamp} coinbase:{self.coinbase} difficulty:{self.difficulty})>'
+        return f'<{self.__class__.__name__}(#{self.number} prevhash:{short_hash(self.prevhash)} timestamp:{timestamp} coinbase:{self.coinbase} difficulty:{self.difficulty})>'
 
     def __eq__(self, other):
         """Two blocks are equal iff they have the same hash."""
@@ -53,7 +86,7 @@ class BlockHeader:
         return not self.__eq__(other)
 
     def __hash__(self):
-        return self.hash
+        return hash(self.hash)
 
 
 class Block:
@@ -0,0 +1,105 @@
+import random
+
+# Where the blocks are stored: one store shared by the whole network, or one for each node
+BLOCK_STORES = ('node', 'shared')
+
+
+class BlockTreeNode:
+    """A block in the tree of blocks of a store, with a pointer to its `parent` node, the
+    hashes of its `children`, its `total_difficulty`, calculated when it is inserted, and a
+    dense `index`, the position in which it was inserted"""
+
+    __slots__ = ('hash', 'number', 'parent', 'children', 'total_difficulty', 'index')
+
+    def __init__(self, block_hash, number: int, parent, total_difficulty: int, index: int):
+        self.hash = block_hash
+        self.number = number
+        self.parent = parent
+        self.children = []
+        self.total_difficulty = total_difficulty
+        self.index = index
+
+
+class BlockStore:
+    """A content-addressed store of blocks, indexed in a tree.
+
+    Each block is kept once, by its hash, in the `db`, together with its node in the tree.
+    A store can be used by the chain of a single node, or shared by the chains of all the
+    nodes of the network, each one keeping only the blocks it knows as a view of the store.
+
+    :param db: the database where the blocks are kept (e.g. a `BaseDB`)
+    """
+
+    def __init__(self, db):
+        self.db = db
+        self._tree = {}
+        # The index of the next block inserted, the blocks removed do not give back their index
+        self._next_index = 0
+
+    def insert(self, block):
+        """Inserts a block, as a child of its parent, which must be in the store (except for
+        the genesis block), and returns its node in the tree. Its total difficulty is the one
+        of the parent plus its difficulty and a random amount, so two blocks at the same height
+        are never tied. A block already in the store is not changed."""
+        tree_node = self._tree.get(block.header.hash)
+        if tree_node is not None:
+            return tree_node
+        if block.header.number == 0:
+            parent = None
+            total_difficulty = 0
+        else:
+            parent = self._tree[block.header.prevhash]
+            total_difficulty = parent.total_difficulty + block.header.difficulty + random.randrange(10**6 + 1)
+        tree_node = BlockTreeNode(
+            block.header.hash, block.header.number, parent, total_difficulty, self._next_index)
+        self._next_index += 1
+        self._tree[block.header.hash] = tree_node
+        if parent is not None:
+            parent.children.append(block.header.hash)
+        self.db.put(block.header.hash, block)
+        return tree_node
+
+    def get(self, block_hash):
+        """Gets the block with a given hash, or None if it is not in the store"""
+        if block_hash not in self._tree:
+            return None
+        return self.db.get(block_hash)
+
+    def remove(self, block_hash):
+        """Removes a block, which must have no children left in the store, and its node in the tree"""
+        tree_node = self._tree[block_hash]
+        if tree_node.children:
+            raise RuntimeError(f'The block {block_hash} still has {len(tree_node.children)} children in the store')
+        del self._tree[block_hash]
+        if tree_node.parent is not None:
+            tree_node.parent.children.remove(block_hash)
+            tree_node.parent = None
+        self.db.delete(block_hash)
+
+    def cut(self, block_hash):
+        """Makes a block the root of the tree, removing all its ancestors, which must have no
+        other children left in the store. Returns the nodes removed"""
+        tree_node = self._tree[block_hash]
+        removed = []
+        ancestor, tree_node.parent = tree_node.parent, None
+        child_hash = block_hash
+        while ancestor is not None:
+            if ancestor.children != [child_hash]:
+                raise RuntimeError(f'The block {ancestor.hash} has other children in the store')
+            del self._tree[ancestor.hash]
+            self.db.delete(ancestor.hash)
+            removed.append(ancestor)
+            child_hash = ancestor.hash
+            parent = ancestor.parent
+            ancestor.parent = None
+            ancestor = parent
+        return removed
+
+    def get_tree_node(self, block_hash):
+        return self._tree.get(block_hash)
+
+    def __contains__(self, block_hash):
+        return block_hash in self._tree
+
+    def __len__(self):
+        return len(self._tree)
@@ -1,34 +1,173 @@
-import random
-import itertools
-from blocksim.utils import time
+from collections import OrderedDict
+from blocksim.utils import short_hash
+
+# Maximum number of orphan blocks (blocks whose parent is unknown) kept by a chain
+MAX_ORPHAN_BLOCKS = 100
+# Simulation seconds an orphan block is kept waiting for its parent
+ORPHAN_EXPIRY = 20 * 60
+# Which orphan block is evicted when the pool is full: the oldest one received, or the one
+# with the highest number, the farthest from being connected
+ORPHAN_EVICTION_POLICIES = ('age', 'height')
+
+
+class OrphanPool:
+    """The blocks received by a chain whose parent is not known yet, waiting for it.
+
+    The pool keeps at most `max_size` blocks, evicting one according to the `eviction`
+    policy when it is full, and a block expires `max_age` simulation seconds after it was
+    received. The blocks are indexed by the hash of their parent, so the children of a block
+    can be found as soon as it arrives.
+
+    :param int max_size: the maximum number of blocks kept
+    :param float max_age: the simulation seconds a block is kept, or None to never expire
+    :param str eviction: the block evicted when the pool is full, the oldest (age) or the one
+        with the highest number (height)
+    """
+
+    def __init__(self, max_size=MAX_ORPHAN_BLOCKS, max_age=ORPHAN_EXPIRY, eviction='age'):
+        if max_size < 1:
+            raise ValueError(f'The orphan pool must keep at least one block, got {max_size}')
+        if eviction not in ORPHAN_EVICTION_POLICIES:
+            raise ValueError(
+                f'Unknown orphan eviction policy {eviction}, available: {ORPHAN_EVICTION_POLICIES}')
+        self.max_size = max_size
+        self.max_age = max_age
+        self.eviction = eviction
+        self.evicted = 0
+        # The blocks and the time they were received, by hash, from the oldest to the newest
+        self._blocks = OrderedDict()
+        self._children = {}
+
+    def add(self, block, now: float):
+        """Adds an orphan `block` received at `now`. Returns False if it was already there"""
+        self.expire(now)
+        if block.header.hash in self._blocks:
+            return False
+        if len(self._blocks) >= self.max_size:
+            if self.eviction == 'age':
+                evicted_hash = next(iter(self._blocks))
+            else:
+                evicted_hash = max(self._blocks, key=lambda h: self._blocks[h][0].header.number)
+            self._remove(evicted_hash)
+            self.evicted += 1
+        self._blocks[block.header.hash] = (block, now)
+        self._children.setdefault(block.header.prevhash, []).append(block.header.hash)
+        return True
+
+    def pop_children(self, block_hash, now: float):
+        """Removes and returns the blocks waiting for the block with `block_hash`"""
+        self.expire(now)
+        children = self._children.pop(block_hash, [])
+        return [self._blocks.pop(child_hash)[0] for child_hash in children]
+
+    def expire(self, now: float):
+        """Removes the blocks received more than `max_age` seconds before `now`"""
+        if self.max_age is None:
+            return
+        while self._blocks:
+            block_hash, (_, received) = next(iter(self._blocks.items()))
+            if now - received <= self.max_age:
+                break
+            self._remove(block_hash)
+            self.evicted += 1
+
+    def prune(self, number: int):
+        """Removes the blocks with a number up to `number`, which can no longer be connected"""
+        for block_hash in [h for h, (block, _) in self._blocks.items() if block.header.number <= number]:
+            self._remove(block_hash)
+            self.evicted += 1
+
+    def _remove(self, block_hash):
+        block, _ = self._blocks.pop(block_hash)
+        siblings = self._children[block.header.prevhash]
+        siblings.remove(block_hash)
+        if not siblings:
+            del self._children[block.header.prevhash]
+
+    def __contains__(self, block_hash):
+        return block_hash in self._blocks
+
+    def __len__(self):
+        return len(self._blocks)
 
 
 class Chain:
     """Defines a base chain model that needs to be extended according to blockchain protocol
-    being simulated"""
+    being simulated
+
+    The blocks are kept in a `BlockStore`, which indexes them in a tree where each block
+    points to its parent and keeps its total difficulty. The store can be shared with the
+    chains of other nodes, so the chain only keeps a view of it: the blocks known by the node,
+    as a bitset indexed by the position of each block in the store, and the canonical chain,
+    as a list with the hash of the block at each height. The canonical chain is updated as
+    blocks are added and reorganizations happen, together with the number of `reorgs` and
+    the depth of the deepest one (`max_reorg_depth`). A reorganization only walks the blocks
+    of the fork, back to the common ancestor.
+
+    The blocks received before their parent wait in a bounded `OrphanPool`, and are connected
+    when the parent arrives, together with the blocks waiting for them, without recursion.
 
-    def __init__(self, env, node, consensus, genesis, db):
+    With a `finality_depth`, the blocks of the canonical chain with that many confirmations
+    are final: the forks from them are forgotten and the blocks received below them are
+    ignored. In a store of its own, the chain also drops the fork blocks, and the last final
+    block becomes the root of the tree: the blocks below it are removed from the store, and
+    only their headers are kept, in a list indexed by the block number. These blocks are no
+    longer served to the peers. With `finality_spill`, a summary of each final block is
+    written to the ``finalized_blocks`` stream of the report."""
+
+    def __init__(self, env, node, consensus, genesis, store):
         self.env = env
         self.node = node
         self.consensus = consensus
-        self.db = db
+        self.store = store
         self.genesis = genesis
 
-        # Set the score (AKA total difficulty in PoW)
-        self.db.put(f'score:{genesis.header.hash}', "0")
-
-        # Init the chain with the Genesis block
-        self.db.put(f'block:{genesis.header.number}', genesis.header.hash)
-        self.db.put(genesis.header.hash, genesis)
+        # Init the chain with the Genesis block, with a score (AKA total difficulty in PoW) of 0
+        self._known = bytearray(8)
+        self._mark_known(self.store.insert(genesis))
+        self._canonical = [genesis.header.hash]
         self._head_hash = genesis.header.hash
-        self.parent_queue = {}
+        self.orphans = OrphanPool(
+            env.config['simulation']['max_orphan_blocks'],
+            env.config['simulation']['orphan_expiry'],
+            env.config['simulation']['orphan_eviction'])
+        self.reorgs = 0
+        self.max_reorg_depth = 0
+        self.finality_depth = env.config['simulation']['finality_depth']
+        self._finality_spill = env.config['simulation']['finality_spill']
+        self.finalized_height = 0
+        # The headers of the blocks removed from the store, below the last final block
+        self._finalized_headers = []
+        # A store shared with other nodes keeps the blocks they may still need
+        self._owns_store = env.config['simulation']['block_store'] == 'node'
 
     @property
     def head(self):
         """Block in the head (tip) of the chain"""
-        block = self.db.get(self._head_hash)
+        block = self.store.get(self._head_hash)
         return block
 
+    @property
+    def height(self):
+        """Number of the block in the head of the chain"""
+        return len(self._canonical) - 1
+
+    @property
+    def canonical_hashes(self):
+        """The hashes of the canonical chain, indexed by the block number. It must not be modified"""
+        return self._canonical
+
+    def summary(self):
+        """Returns a summary of the canonical chain, without walking it"""
+        return {
+            'head_block_hash': f'{short_hash(self._head_hash)} #{self.height}',
+            'number_of_blocks': self.height,
+            'forks': self.env.data[f'forks_{self.node.address}'],
+            'reorgs': self.reorgs,
+            'max_reorg_depth': self.max_reorg_depth,
+            'finalized_height': self.finalized_height
+        }
+
     def get_parent(self, block):
         """Genesis Block do not have parent"""
         if block.header.number == 0:
@@ -37,66 +176,64 @@ class Chain:
 
     def get_block(self, block_hash):
         """Gets the block with a given block hash"""
-        try:
-            return self.db.get(block_hash)
-        except BaseException:
+        if self._get_tree_node(block_hash) is None:
             return None
+        return self.store.get(block_hash)
 
     def get_blockhash_by_number(self, number):
         """Gets the hash of the block with the given block number"""
-        try:
-            return self.db.get(f'block:{number}')
-        except BaseException:
+        if number is None or not 0 <= number < len(self._canonical):
             return None
+        return self._canonical[number]
 
     def get_block_by_number(self, number):
         """Gets the block with the given block number"""
         return self.get_block(self.get_blockhash_by_number(number))
 
-    def add_child(self, child):
-        """Add a record allowing you to later look up the provided block's
-        parent hash and see that it is one of its children"""
-        try:
-            existing = self.db.get('child:' + child.header.prevhash)
-        except BaseException:
-            existing = ''
-        existing_hashes = []
-        for i in range(0, len(existing), 32):
-            existing_hashes.append(existing[i: i + 32])
-        if child.header.hash not in existing_hashes:
-            self.db.put(
-                'child:' + child.header.prevhash,
-                existing + child.header.hash)
+    def get_header_by_number(self, number):
+        """Gets the header of the block of the canonical chain with the given block number,
+        also when the block was finalized and removed from the store"""
+        if number is not None and 0 <= number < len(self._finalized_headers):
+            return self._finalized_headers[number]
+        block = self.get_block_by_number(number)
+        return block.header if block is not None else None
+
+    def _get_tree_node(self, block_hash):
+        """Returns the node in the tree of the store of a block known by this chain"""
+        tree_node = self.store.get_tree_node(block_hash)
+        if tree_node is None or not self._is_known(tree_node):
+            return None
+        return tree_node
+
+    def _is_known(self, tree_node):
+        byte = tree_node.index >> 3
+        return byte < len(self._known) and bool(self._known[byte] & (1 << (tree_node.index & 7)))
+
+    def _mark_known(self, tree_node):
+        byte = tree_node.index >> 3
+        if byte >= len(self._known):
+            self._known.extend(bytes(max(byte + 1, 2 * len(self._known)) - len(self._known)))
+        self._known[byte] |= 1 << (tree_node.index & 7)
+
+    def _insert(self, block):
+        """Inserts a block in the store, if it is not there yet, and marks it as known"""
+        tree_node = self.store.insert(block)
+        self._mark_known(tree_node)
+        return tree_node
 
     def get_child_hashes(self, block_hash):
         """Get the hashes of all known children of a given block"""
-        child_hashes = []
-        try:
-            data = self.db.get('child:' + block_hash)
-            for i in range(0, len(data), 32):
-                child_hashes.append(data[i:i + 32])
-            return child_hashes
-        except BaseException:
+        tree_node = self._get_tree_node(block_hash)
+        if tree_node is None:
             return []
+        return [h for h in tree_node.children if self._get_tree_node(h) is not None]
 
     def get_pow_difficulty(self, block):
         """Get the total difficulty in PoW of a given block"""
         if not block:
             return 0
-        key = f'score:{block.header.hash}'
-        fills = []
-        while key not in self.db:
-            fills.insert(0, (block.header.hash, block.header.difficulty))
-            key = f'score:{block.header.prevhash}'
-            block = self.get_parent(block)
-            if block is None:
-                return 0
-        score = int(self.db.get(key))
-        for h, d in fills:
-            key = f'score:{h}'
-            score = score + d + random.randrange(10**6 + 1)
-            self.db.put(key, str(score))
-        return score
+        tree_node = self._get_tree_node(block.header.hash)
+        return tree_node.total_difficulty if tree_node is not None else 0
 
     def get_children(self, block):
         """Get the children of a block"""
@@ -104,83 +241,129 @@ class Chain:
 
     def add_block(self, block):
         """Call upon receiving a block"""
+        if self.finality_depth is not None and block.header.number <= self.finalized_height:
+            self.env.logger.chain.debug(
+                self.node.address, 'Ignoring block #%s (%s) below the finalized block #%s',
+                block.header.number, short_hash(block.header.hash), self.finalized_height)
+            return False
+        if not self._connect_block(block):
+            if self.orphans.add(block, self.env.now):
+                self.env.logger.chain.info(
+                    self.node.address, 'Got block #%s (%s) with prevhash %s, parent not found. Delaying for now',
+                    block.header.number, short_hash(block.header.hash), short_hash(block.header.prevhash))
+            return False
+        # Are there blocks that we received that were waiting for this block?
+        # If so, process them, and then the blocks waiting for each one of them, depth first
+        now = self.env.now
+        waiting = [iter(self.orphans.pop_children(block.header.hash, now))]
+        while waiting:
+            orphan = next(waiting[-1], None)
+            if orphan is None:
+                waiting.pop()
+            elif self._connect_block(orphan):
+                waiting.append(iter(self.orphans.pop_children(orphan.header.hash, now)))
+        if self.finality_depth is not None and self.height - self.finality_depth > self.finalized_height:
+            self._finalize(self.height - self.finality_depth)
+        return True
+
+    def _connect_block(self, block):
+        """Connects a block to the tree, if its parent is known, returning False otherwise"""
         # Is the block being added to the heap?
         if block.header.prevhash == self._head_hash:
-            print(
-                f'{self.node.address} at {time(self.env)}: Adding block #{block.header.number} ({block.header.hash[:8]}) to the head', )
-            self.db.put(f'block:{block.header.number}', block.header.hash)
+            self.env.logger.chain.info(
+                self.node.address, 'Adding block #%s (%s) to the head',
+                block.header.number, short_hash(block.header.hash))
+            self._insert(block)
+            self._canonical.append(block.header.hash)
             self._head_hash = block.header.hash
         # Or is the block being added to a chain that is not currently the head?
-        elif block.header.prevhash in self.db:
-            print(
-                f'{self.node.address} at {time(self.env)}: Receiving block #{block.header.number} ({block.header.hash[:8]}) not on head ({self._head_hash[:8]}), adding to secondary chain')
+        elif self._get_tree_node(block.header.prevhash) is not None:
+            self.env.logger.chain.info(
+                self.node.address, 'Receiving block #%s (%s) not on head (%s), adding to secondary chain',
+                block.header.number, short_hash(block.header.hash), short_hash(self._head_hash))
             key = f'forks_{self.node.address}'
             self.env.data[key] += 1
-            block_td = self.get_pow_difficulty(block)
+            tree_node = self._insert(block)
             # If the block should be the new head, replace the head
-            if block_td > self.get_pow_difficulty(self.head):
-                b = block
-                new_chain = {}
-                # Find common ancestor
-                while b.header.number >= 0:
-                    new_chain[b.header.number] = b
-                    key = f'block:{b.header.number}'
-                    orig_at_height = self.db.get(
-                        key) if key in self.db else None
-                    if orig_at_height == b.header.hash:
-                        break
-                    if b.header.prevhash not in self.db or self.db.get(
-                            b.header.prevhash) == self.genesis.header.hash:
-                        break
-                    b = self.get_parent(b)
-                replace_from = b.header.number
-                # Replace block index and transactions
-
-                # Read: for i in range(common ancestor block number...new block
-                # number)
-                for i in itertools.count(replace_from):
-                    print(
-                        f'{self.node.address} at {time(self.env)}: Rewriting height {i}')
-                    key = f'block:{i}'
-                    # Delete data for old blocks
-                    orig_at_height = self.db.get(
-                        key) if key in self.db else None
-                    if orig_at_height:
-                        orig_block_at_height = self.get_block(orig_at_height)
-                        print(
-                            f'{self.node.address} at {time(self.env)}: {orig_block_at_height.header.hash} no longer in main chain')
-                        # Delete from block index
-                        self.db.delete(key)
-                    # Add data for new blocks
-                    if i in new_chain:
-                        new_block_at_height = new_chain[i]
-                        print(
-                            f'{self.node.address} at {time(self.env)}: {new_block_at_height.header.hash} now in main chain')
-                        # Add to block index
-                        self.db.put(key, new_block_at_height.header.hash)
-                    if i not in new_chain and not orig_at_height:
-                        break
-                self._head_hash = block.header.hash
+            if tree_node.total_difficulty > self.store.get_tree_node(self._head_hash).total_difficulty:
+                self._reorganize(tree_node)
         # Block has no parent yet. An Orphan block
         else:
-            if block.header.prevhash not in self.parent_queue:
-                self.parent_queue[block.header.prevhash] = []
-            self.parent_queue[block.header.prevhash].append(block)
-            print(
-                f'{self.node.address} at {time(self.env)}: Got block #{block.header.number} ({block.header.hash[:8]}) with prevhash {block.header.prevhash[:8]}, parent not found. Delaying for now')
             return False
 
-        self.add_child(block)
+        if self.env.trace is not None:
+            self.env.trace.add_block(self.env.now, self.node.node_id, block.header.hash)
+        return True
 
-        self.db.put(block.header.hash, block)
+    def _reorganize(self, tree_node):
+        """Makes the block of `tree_node` the new head, replacing the blocks of the canonical
+        chain from the common ancestor"""
+        # Find the common ancestor, the first block of the fork in the canonical chain
+        new_chain = []
+        ancestor = tree_node
+        while not self._is_canonical(ancestor):
+            new_chain.append(ancestor.hash)
+            ancestor = ancestor.parent
+        replace_from = ancestor.number + 1
+        # Replace the block index from the common ancestor to the new block
+        reorg_depth = len(self._canonical) - replace_from
+        for block_hash in self._canonical[replace_from:]:
+            self.env.logger.chain.debug(
+                self.node.address, '%s no longer in main chain', short_hash(block_hash))
+        del self._canonical[replace_from:]
+        for block_hash in reversed(new_chain):
+            self.env.logger.chain.debug(
+                self.node.address, '%s now in main chain', short_hash(block_hash))
+            self._canonical.append(block_hash)
+        if reorg_depth:
+            self.reorgs += 1
+            self.max_reorg_depth = max(self.max_reorg_depth, reorg_depth)
+        self._head_hash = tree_node.hash
 
-        # Are there blocks that we received that were waiting for this block?
-        # If so, process them.
-        if block.header.hash in self.parent_queue:
-            for _block in self.parent_queue[block.header.hash]:
-                self.add_block(_block)
-            del self.parent_queue[block.header.hash]
-        return True
+    def _finalize(self, number: int):
+        """Makes final the blocks of the canonical chain up to `number`, forgetting the forks
+        from them and, in a store of its own, making the block `number` the root of the tree"""
+        for height in range(self.finalized_height + 1, number + 1):
+            tree_node = self.store.get_tree_node(self._canonical[height - 1])
+            for child_hash in list(tree_node.children):
+                if child_hash != self._canonical[height]:
+                    self._prune_fork(self.store.get_tree_node(child_hash))
+            if self._finality_spill:
+                block = self.store.get(self._canonical[height])
+                self.env.report.write('finalized_blocks', {
+                    'node': self.node.address,
+                    'number': height,
+                    'hash': block.header.hash,
+                    'transactions': len(block.transactions) if block.transactions is not None else 0
+                })
+        if self._owns_store:
+            # Keep the headers of the blocks below the new root, and remove them
+            for height in range(self.finalized_height, number):
+                self._finalized_headers.append(self.store.get(self._canonical[height]).header)
+            for tree_node in self.store.cut(self._canonical[number]):
+                self._forget(tree_node)
+        self.finalized_height = number
+        self.orphans.prune(number)
+        self.env.logger.chain.debug(self.node.address, 'Blocks finalized up to #%s', number)
+
+    def _prune_fork(self, tree_node):
+        """Forgets the blocks of the fork starting in `tree_node`, removing them from a store
+        of its own, from the tips to the first block of the fork"""
+        fork = [tree_node]
+        for fork_node in fork:
+            fork.extend(self.store.get_tree_node(h) for h in fork_node.children)
+        for fork_node in reversed(fork):
+            self._forget(fork_node)
+            if self._owns_store:
+                self.store.remove(fork_node.hash)
+
+    def _forget(self, tree_node):
+        byte = tree_node.index >> 3
+        if byte < len(self._known):
+            self._known[byte] &= ~(1 << (tree_node.index & 7)) & 0xff
+
+    def _is_canonical(self, tree_node):
+        return tree_node.number < len(self._canonical) and self._canonical[tree_node.number] == tree_node.hash
 
     def __contains__(self, block):
         try:
@@ -192,19 +375,18 @@ class Chain:
 
     def get_blockhashes_from_hash(self, block_hash, max_num):
         """Get blockhashes starting from a hash and going backwards"""
-        block = self.get_block(block_hash)
-        if block is None:
+        tree_node = self._get_tree_node(block_hash)
+        if tree_node is None or max_num < 1:
             return []
-
-        header = block.header
         hashes = []
-        hashes.append(block.header.hash)
-        for i in range(max_num - 1):  # We already have one block added to the hashes list
-            block = self.get_block(header.prevhash)
-            if block is None:
-                break
-            header = block.header
-            hashes.append(header.hash)
-            if header.number == 0:
-                break
+        # Walk the blocks outside the canonical chain, until joining it
+        while not self._is_canonical(tree_node):
+            hashes.append(tree_node.hash)
+            if len(hashes) == max_num:
+                return hashes
+            tree_node = tree_node.parent
+        # The rest are a slice of the canonical chain, in reverse order, down to the first
+        # block still in the store
+        first = max(tree_node.number - (max_num - len(hashes)) + 1, len(self._finalized_headers))
+        hashes.extend(reversed(self._canonical[first:tree_node.number + 1]))
         return hashes
@@ -1,4 +1,7 @@
-from blocksim.utils import get_random_values
+import numpy as np
+
+# How the items of a message (e.g. the transactions of a batch) are validated
+VALIDATION_MODELS = ('sequential', 'parallel')
 
 
 class Consensus:
@@ -9,6 +12,11 @@ class Consensus:
 
     In order to simplify, we only take into account the duration of block and transaction validation,
     given by the user as simulation input.
+
+    The items of a message are validated as a batch. With the ``sequential`` validation model
+    they are validated one after the other, and the delay of the batch is the sum of their
+    delays. With the ``parallel`` model they are split evenly between `validation_workers`
+    workers, and the delay of the batch is the delay of the slowest worker.
     """
 
     def __init__(self, env):
@@ -23,13 +31,32 @@ class Consensus:
     def validate_block(self, block=None):
         """ Simulates the block validation.
         For now, it only applies a delay in simulation, corresponding to previous measurements"""
-        delay = round(get_random_values(
-            self.env.delays['block_validation'])[0], 4)
-        return delay
+        return self.env.delays['block_validation'].get()
 
     def validate_transaction(self, tx=None):
         """ Simulates the transaction validation.
         For now, it only calculates a delay in simulation, corresponding to previous measurements"""
-        delay = round(get_random_values(
-            self.env.delays['tx_validation'])[0], 4)
-        return delay
+        return self.env.delays['tx_validation'].get()
+
+    def validate_blocks(self, n: int):
+        """Simulates the validation of `n` blocks, returning the delay of the whole batch"""
+        return self._validate_batch(self.env.delays['block_validation'], n)
+
+    def validate_transactions(self, n: int):
+        """Simulates the validation of `n` transactions, returning the delay of the whole batch"""
+        return self._validate_batch(self.env.delays['tx_validation'], n)
+
+    def _validate_batch(self, pool, n: int):
+        if n == 1:
+            return pool.get()
+        if n < 1:
+            return 0.0
+        delays = pool.take(n)
+        workers = self.env.config['simulation']['validation_workers']
+        if self.env.config['simulation']['validation_model'] == 'sequential' or workers == 1:
+            return float(delays.sum())
+        # Give the items to the workers in turns, the batch ends when the last worker ends
+        rows = -(-n // workers)
+        per_worker = np.zeros(rows * workers)
+        per_worker[:n] = delays
+        return float(per_worker.reshape(rows, workers).sum(axis=0).max())
@@ -1,3 +1,21 @@
+import os
+import pickle
+import sqlite3
+import tempfile
+from collections import OrderedDict
+
+# Backends of the databases of a simulation
+DB_BACKENDS = ('memory', 'sqlite')
+
+# Number of entries of each SQLite database kept in memory, the most recently used
+DEFAULT_CACHE_SIZE = 1024
+# Number of writes of each SQLite database buffered before being written to the file
+DEFAULT_BATCH_SIZE = 1000
+
+_DELETED = object()
+_MISSING = object()
+
+
 class BaseDB:
     def __init__(self):
         self.db = {}
@@ -19,3 +37,182 @@ class BaseDB:
 
     def __eq__(self, other):
         return isinstance(other, self.__class__) and self.db == other.db
+
+
+class SqliteDB(BaseDB):
+    """A database kept in a table of a SQLite file, with the same interface as `BaseDB`.
+
+    The values are pickled. The writes are buffered and written to the file in batches of
+    `batch_size`, in a single transaction, and the `cache_size` most recently used entries
+    are also kept in memory, so the recent blocks and the head are read without touching
+    the file.
+
+    :param connection: the `sqlite3` connection to the file
+    :param str table: the name of the table, each database of the file has its own table
+    :param int cache_size: the number of entries kept in memory
+    :param int batch_size: the number of writes buffered before being written
+    """
+
+    def __init__(self, connection, table: str, cache_size=DEFAULT_CACHE_SIZE, batch_size=DEFAULT_BATCH_SIZE):
+        if batch_size < 1:
+            raise ValueError(f'The batch size of a database must be positive, got {batch_size}')
+        self._connection = connection
+        self._table = table
+        self.cache_size = cache_size
+        self.batch_size = batch_size
+        self._cache = OrderedDict()
+        self._pending = {}
+        # Without a type, SQLite keeps the keys as given, both strings and integers
+        connection.execute(f'CREATE TABLE IF NOT EXISTS {table} (key PRIMARY KEY, value BLOB)')
+
+    def get(self, key):
+        cache = self._cache
+        if key in cache:
+            cache.move_to_end(key)
+            return cache[key]
+        value = self._pending.get(key, _MISSING)
+        if value is _MISSING:
+            row = self._connection.execute(
+                f'SELECT value FROM {self._table} WHERE key = ?', (key,)).fetchone()
+            if row is None:
+                raise KeyError(key)
+            value = pickle.loads(row[0])
+        elif value is _DELETED:
+            raise KeyError(key)
+        self._remember(key, value)
+        return value
+
+    def put(self, key, value):
+        self._remember(key, value)
+        self._write(key, value)
+
+    def delete(self, key):
+        if key not in self:
+            raise KeyError(key)
+        self._cache.pop(key, None)
+        self._write(key, _DELETED)
+
+    def _has_key(self, key):
+        if key in self._cache:
+            return True
+        value = self._pending.get(key, _MISSING)
+        if value is not _MISSING:
+            return value is not _DELETED
+        return self._connection.execute(
+            f'SELECT 1 FROM {self._table} WHERE key = ?', (key,)).fetchone() is not None
+
+    def _remember(self, key, value):
+        if self.cache_size < 1:
+            return
+        cache = self._cache
+        cache[key] = value
+        cache.move_to_end(key)
+        if len(cache) > self.cache_size:
+            cache.popitem(last=False)
+
+    def _write(self, key, value):
+        self._pending[key] = value
+        if len(self._pending) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        """Writes the buffered writes to the file, in a single transaction"""
+        if not self._pending:
+            return
+        deleted = [(key,) for key, value in self._pending.items() if value is _DELETED]
+        written = [(key, pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL))
+                   for key, value in self._pending.items() if value is not _DELETED]
+        with self._connection:
+            if deleted:
+                self._connection.executemany(f'DELETE FROM {self._table} WHERE key = ?', deleted)
+            if written:
+                self._connection.executemany(
+                    f'INSERT OR REPLACE INTO {self._table} (key, value) VALUES (?, ?)', written)
+        self._pending = {}
+
+    def __eq__(self, other):
+        return self is other
+
+
+class DBFactory:
+    """Creates the databases of a simulation, all of them in memory (``memory`` backend), or
+    each one as a table of a single SQLite file (``sqlite`` backend).
+
+    Only the blocks, with their headers and transactions, are kept in the file. The block
+    tree of each store and the canonical index of each chain stay in memory, so the memory
+    saved is that of the block contents.
+
+    Without a `path`, the SQLite file is created in a temporary directory and removed when
+    the factory is closed. A `path` to a file that is not empty is refused, unless
+    `overwrite` is set, and then the tables left by an earlier simulation are dropped.
+
+    :param str name: the backend of the databases, memory or sqlite
+    :param str path: the SQLite file
+    :param bool overwrite: whether the databases of an earlier simulation in `path` can be dropped
+    :param int cache_size: the number of entries of each SQLite database kept in memory
+    :param int batch_size: the number of writes of each SQLite database buffered
+    """
+
+    def __init__(self, name='memory', path=None, overwrite=False, cache_size=DEFAULT_CACHE_SIZE,
+                 batch_size=DEFAULT_BATCH_SIZE):
+        if name not in DB_BACKENDS:
+            raise ValueError(f'Unknown database backend {name}, available: {DB_BACKENDS}')
+        if name == 'sqlite' and path is not None and not overwrite \
+                and os.path.isfile(path) and os.path.getsize(path) > 0:
+            raise ValueError(f'The database file {path} already exists, set overwrite to replace its contents')
+        self.name = name
+        self.cache_size = cache_size
+        self.batch_size = batch_size
+        self._databases = []
+        self._connection = None
+        self._temporary = False
+        self.path = path
+        if name == 'sqlite':
+            if path is None:
+                handle, self.path = tempfile.mkstemp(suffix='.sqlite')
+                os.close(handle)
+                self._temporary = True
+            else:
+                directory = os.path.dirname(path)
+                if directory:
+                    os.makedirs(directory, exist_ok=True)
+            self._connection = sqlite3.connect(self.path)
+            # The file is only a store for the data that does not fit in memory, it does not
+            # need to survive a crash
+            self._connection.execute('PRAGMA journal_mode = OFF')
+            self._connection.execute('PRAGMA synchronous = OFF')
+            if not self._temporary:
+                self._drop_tables()
+
+    def _drop_tables(self):
+        """Drops the tables of the databases of an earlier simulation kept in the file, and
+        gives their space back, so the file only keeps the data of this simulation"""
+        tables = [row[0] for row in self._connection.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'table' AND name LIKE 'db\\_%' ESCAPE '\\'")]
+        if not tables:
+            return
+        with self._connection:
+            for table in tables:
+                self._connection.execute(f'DROP TABLE {table}')
+        self._connection.execute('VACUUM')
+
+    def create(self):
+        """Returns a new empty database"""
+        if self._connection is None:
+            return BaseDB()
+        db = SqliteDB(self._connection, f'db_{len(self._databases)}', self.cache_size, self.batch_size)
+        self._databases.append(db)
+        return db
+
+    def flush(self):
+        for db in self._databases:
+            db.flush()
+
+    def close(self):
+        if self._connection is None:
+            return
+        self.flush()
+        self._connection.close()
+        self._connection = None
+        if self._temporary:
+            os.remove(self.path)
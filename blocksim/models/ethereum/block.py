@@ -18,6 +18,10 @@ class BlockHeader(BaseBlockHeader):
     :param str nonce: a nonce constituting a Proof-of-Work
     """
 
+    __slots__ = ('gas_limit', 'gas_used')
+
+    _fields = BaseBlockHeader._fields + ('gas_limit', 'gas_used')
+
     def __init__(self,
                  prevhash=encode_hex(b'\x00' * 32),
                  number=0,
@@ -27,9 +31,10 @@ class BlockHeader(BaseBlockHeader):
                  gas_limit=3000000,
                  gas_used=0,
                  nonce=''):
+        # Set before the base class, which hashes all the fields of the header
+        object.__setattr__(self, 'gas_limit', gas_limit)
+        object.__setattr__(self, 'gas_used', gas_used)
         super().__init__(prevhash, number, timestamp, coinbase, difficulty, nonce)
-        self.gas_limit = gas_limit
-        self.gas_used = gas_used
 
 
 class Block(BaseBlock):
@@ -1,10 +1,88 @@
 from blocksim.utils import kB_to_MB
+from blocksim.models.message import NetworkMessage, STATUS, NEW_BLOCKS, TRANSACTIONS, GET_HEADERS, \
+    BLOCK_HEADERS, GET_BLOCK_BODIES, BLOCK_BODIES
+
+
+class StatusMessage(NetworkMessage):
+    __slots__ = ('protocol_version', 'network', 'td', 'best_hash', 'genesis_hash')
+
+    code = STATUS
+
+    def __init__(self, protocol_version: str, network: str, td: int, best_hash, genesis_hash, size: float):
+        super().__init__(size)
+        self.protocol_version = protocol_version
+        self.network = network
+        self.td = td
+        self.best_hash = best_hash
+        self.genesis_hash = genesis_hash
+
+
+class NewBlocksMessage(NetworkMessage):
+    __slots__ = ('new_blocks',)
+
+    code = NEW_BLOCKS
+
+    def __init__(self, new_blocks: dict, size: float):
+        super().__init__(size)
+        self.new_blocks = new_blocks
+
+
+class TransactionsMessage(NetworkMessage):
+    __slots__ = ('transactions',)
+
+    code = TRANSACTIONS
+
+    def __init__(self, transactions, size: float):
+        super().__init__(size)
+        self.transactions = transactions
+
+
+class GetHeadersMessage(NetworkMessage):
+    __slots__ = ('block_number', 'max_headers')
+
+    code = GET_HEADERS
+
+    def __init__(self, block_number: int, max_headers: int, size: float):
+        super().__init__(size)
+        self.block_number = block_number
+        self.max_headers = max_headers
+
+
+class BlockHeadersMessage(NetworkMessage):
+    __slots__ = ('block_headers',)
+
+    code = BLOCK_HEADERS
+
+    def __init__(self, block_headers: list, size: float):
+        super().__init__(size)
+        self.block_headers = block_headers
+
+
+class GetBlockBodiesMessage(NetworkMessage):
+    __slots__ = ('hashes',)
+
+    code = GET_BLOCK_BODIES
+
+    def __init__(self, hashes: list, size: float):
+        super().__init__(size)
+        self.hashes = hashes
+
+
+class BlockBodiesMessage(NetworkMessage):
+    __slots__ = ('block_bodies',)
+
+    code = BLOCK_BODIES
+
+    def __init__(self, block_bodies: dict, size: float):
+        super().__init__(size)
+        self.block_bodies = block_bodies
 
 
 class Message:
     """Defines a model for the network messages of the Ethereum blockchain.
 
     For each message its calculated the size, taking into account measurements from the live and public network.
+    The sizes of the messages with a fixed size are calculated once, when the model is created.
 
     Ethereum Wire Protocol: https://github.com/ethereum/wiki/wiki/Ethereum-Wire-Protocol
     """
@@ -13,52 +91,39 @@ class Message:
         self.origin_node = origin_node
         _env = origin_node.env
         self._message_size = _env.config['ethereum']['message_size_kB']
+        self._status_size = kB_to_MB(self._message_size['status'])
+        self._get_headers_size = kB_to_MB(self._message_size['get_headers'])
 
     def status(self):
         """ Inform a peer of its current Ethereum state.
         This message should be sent `after` the initial handshake and `prior` to any ethereum related messages.
         """
-        return {
-            'id': 'status',
-            'protocol_version': 'PV62',
-            'network': self.origin_node.network.name,
-            'td': self.origin_node.chain.head.header.difficulty,
-            'best_hash': self.origin_node.chain.head.header.hash,
-            'genesis_hash': self.origin_node.chain.genesis.header.hash,
-            'size': kB_to_MB(self._message_size['status'])
-        }
+        return StatusMessage(
+            'PV62',
+            self.origin_node.network.name,
+            self.origin_node.chain.head.header.difficulty,
+            self.origin_node.chain.head.header.hash,
+            self.origin_node.chain.genesis.header.hash,
+            self._status_size)
 
     def new_blocks(self, new_blocks: dict):
         """Advertises one or more new blocks which have appeared on the network"""
         num_new_block_hashes = len(new_blocks)
         new_blocks_size = num_new_block_hashes * \
             self._message_size['hash_size']
-        return {
-            'id': 'new_blocks',
-            'new_blocks': new_blocks,
-            'size': kB_to_MB(new_blocks_size)
-        }
+        return NewBlocksMessage(new_blocks, kB_to_MB(new_blocks_size))
 
-    def transactions(self, transactions: list):
+    def transactions(self, transactions):
         """ Specify (a) transaction(s) that the peer should make sure is included on its
         transaction queue. Nodes must not resend the same transaction to a peer in the same session.
         This packet must contain at least one (new) transaction.
         """
         num_txs = len(transactions)
         transactions_size = num_txs * self._message_size['tx']
-        return {
-            'id': 'transactions',
-            'transactions': transactions,
-            'size': kB_to_MB(transactions_size)
-        }
+        return TransactionsMessage(transactions, kB_to_MB(transactions_size))
 
     def get_headers(self, block_number: int, max_headers: int):
-        return {
-            'id': 'get_headers',
-            'block_number': block_number,
-            'max_headers': max_headers,
-            'size': kB_to_MB(self._message_size['get_headers'])
-        }
+        return GetHeadersMessage(block_number, max_headers, self._get_headers_size)
 
     def block_headers(self, block_headers: list):
         """ Reply to `get_headers` the items in the list are block headers.
@@ -67,19 +132,11 @@ class Message:
         """
         num_headers = len(block_headers)
         block_headers_size = num_headers * self._message_size['header']
-        return {
-            'id': 'block_headers',
-            'block_headers': block_headers,
-            'size': kB_to_MB(block_headers_size)
-        }
+        return BlockHeadersMessage(block_headers, kB_to_MB(block_headers_size))
 
     def get_block_bodies(self, hashes: list):
         block_bodies_size = len(hashes) * self._message_size['hash_size']
-        return {
-            'id': 'get_block_bodies',
-            'hashes': hashes,
-            'size': kB_to_MB(block_bodies_size)
-        }
+        return GetBlockBodiesMessage(hashes, kB_to_MB(block_bodies_size))
 
     def block_bodies(self, block_bodies: dict):
         """ Reply to `get_block_bodies`. The items in the list are some of the blocks, minus the header.
@@ -90,10 +147,6 @@ class Message:
             txsCount += len(block_txs)
         message_size = (
             txsCount * self._message_size['tx']) + self._message_size['block_bodies']
-        print(
-            f'block bodies with {txsCount} txs have a message size: {message_size} kB')
-        return {
-            'id': 'block_bodies',
-            'block_bodies': block_bodies,
-            'size': kB_to_MB(message_size)
-        }
+        self.origin_node.env.logger.network.debug(
+            self.origin_node.address, 'Block bodies with %s txs have a message size: %s kB', txsCount, message_size)
+        return BlockBodiesMessage(block_bodies, kB_to_MB(message_size))
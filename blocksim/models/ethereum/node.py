@@ -1,12 +1,18 @@
+import numpy as np
 from blocksim.models.node import Node
 from blocksim.models.network import Network
 from blocksim.models.chain import Chain
 from blocksim.models.consensus import Consensus
-from blocksim.models.db import BaseDB
 from blocksim.models.transaction_queue import TransactionQueue
-from blocksim.utils import time
+from blocksim.models.transaction_batch import TransactionBatch
+from blocksim.utils import short_hash
 from blocksim.models.ethereum.block import Block, BlockHeader
 from blocksim.models.ethereum.message import Message
+from blocksim.models.message import STATUS, NEW_BLOCKS, TRANSACTIONS, GET_HEADERS, BLOCK_HEADERS, \
+    GET_BLOCK_BODIES, BLOCK_BODIES
+
+# Maximum block headers requested at once, to fetch the ancestors of an orphan block
+MAX_HEADERS_FETCH = 192
 
 
 class ETHNode(Node):
@@ -20,7 +26,7 @@ class ETHNode(Node):
         # Create the Ethereum genesis block and init the chain
         genesis = Block(BlockHeader())
         consensus = Consensus(env)
-        chain = Chain(env, self, consensus, genesis, BaseDB())
+        chain = Chain(env, self, consensus, genesis, network.block_store())
         self.hashrate = hashrate
         self.is_mining = is_mining
         super().__init__(env,
@@ -36,6 +42,16 @@ class ETHNode(Node):
             self.transaction_queue = TransactionQueue(
                 env, self, self.consensus)
         self._handshaking = env.event()
+        # The handler of each type of message received
+        self._handlers = {
+            STATUS: self._receive_status,
+            NEW_BLOCKS: self._receive_new_blocks,
+            TRANSACTIONS: self._receive_full_transactions,
+            GET_HEADERS: self._send_block_headers,
+            BLOCK_HEADERS: self._receive_block_headers,
+            GET_BLOCK_BODIES: self._send_block_bodies,
+            BLOCK_BODIES: self._receive_block_bodies
+        }
 
     def build_new_block(self):
         """Builds a new candidate block and propagate it to the network
@@ -49,18 +65,13 @@ class ETHNode(Node):
         if self.is_mining is False:
             raise RuntimeError(f'Node {self.location} is not a miner')
         gas_limit_per_block = self.env.config['ethereum']['block_gas_limit']
-        txs_intrinsic_gas = 0
-        pending_txs = []
-        while txs_intrinsic_gas < gas_limit_per_block:
-            if self.transaction_queue.is_empty():
-                break
-            pending_tx = self.transaction_queue.get()
-            pending_txs.append(pending_tx)
-            txs_intrinsic_gas += pending_tx.startgas
+        pending_txs = self.transaction_queue.get_by_gas(gas_limit_per_block)
+        txs_intrinsic_gas = int(pending_txs.startgas.sum())
         candidate_block = self._build_candidate_block(
             pending_txs, gas_limit_per_block, txs_intrinsic_gas)
-        print(
-            f'{self.address} at {time(self.env)}: New candidate block #{candidate_block.header.number} created {candidate_block.header.hash[:8]} with difficulty {candidate_block.header.difficulty}')
+        self.env.logger.consensus.info(
+            self.address, 'New candidate block #%s created %s with difficulty %s',
+            candidate_block.header.number, short_hash(candidate_block.header.hash), candidate_block.header.difficulty)
         # Add the candidate block to the chain of the miner node
         self.chain.add_block(candidate_block)
         # We need to broadcast the new candidate block across the network
@@ -85,20 +96,9 @@ class ETHNode(Node):
 
     def _read_envelope(self, envelope):
         super()._read_envelope(envelope)
-        if envelope.msg['id'] == 'status':
-            self._receive_status(envelope)
-        if envelope.msg['id'] == 'new_blocks':
-            self._receive_new_blocks(envelope)
-        if envelope.msg['id'] == 'transactions':
-            self._receive_full_transactions(envelope)
-        if envelope.msg['id'] == 'get_headers':
-            self._send_block_headers(envelope)
-        if envelope.msg['id'] == 'block_headers':
-            self._receive_block_headers(envelope)
-        if envelope.msg['id'] == 'get_block_bodies':
-            self._send_block_bodies(envelope)
-        if envelope.msg['id'] == 'block_bodies':
-            self._receive_block_bodies(envelope)
+        handler = self._handlers.get(envelope.msg.code)
+        if handler is not None:
+            handler(envelope)
 
     ##              ##
     ## Handshake    ##
@@ -114,13 +114,13 @@ class ETHNode(Node):
         head and genesis blocks
         This message should be sent after the initial handshake and prior to any ethereum related messages."""
         status_msg = self.network_message.status()
-        print(
-            f'{self.address} at {time(self.env)}: Status message sent to {destination_address}')
+        self.env.logger.network.debug(
+            self.address, 'Status message sent to %s', destination_address)
         self.env.process(self.send(destination_address, status_msg))
 
     def _receive_status(self, envelope):
-        print(
-            f'{self.address} at {time(self.env)}: Receive status from {envelope.origin.address}')
+        self.env.logger.network.debug(
+            self.address, 'Receive status from %s', envelope.origin.address)
         node = self.active_sessions.get(envelope.origin.address)
         node['status'] = envelope.msg
         self.active_sessions[envelope.origin.address] = node
@@ -131,37 +131,39 @@ class ETHNode(Node):
     ## Transactions ##
     ##              ##
 
-    def broadcast_transactions(self, transactions: list):
+    def broadcast_transactions(self, transactions: TransactionBatch):
         """Broadcast transactions to all nodes with an active session and mark the hashes
         as known by each node"""
         yield self.connecting  # Wait for all connections
         yield self._handshaking  # Wait for handshaking to be completed
+        tx_hashes = transactions.hashes
+        unknown = [True] * len(tx_hashes)
         for node_address, node in self.active_sessions.items():
-            for tx in transactions:
+            for i, tx_hash in enumerate(tx_hashes):
+                if not unknown[i]:
+                    continue
                 # Checks if the transaction was previous sent
-                if any({tx.hash} & node.get('knownTxs')):
-                    print(
-                        f'{self.address} at {time(self.env)}: Transaction {tx.hash[:8]} was already sent to {node_address}')
-                    transactions.remove(tx)
+                if tx_hash in node.get('knownTxs'):
+                    self.env.logger.mempool.debug(
+                        self.address, 'Transaction %s was already sent to %s', short_hash(tx_hash), node_address)
+                    unknown[i] = False
                 else:
-                    self._mark_transaction(tx.hash, node_address)
+                    self._mark_transaction(tx_hash, node_address)
+        transactions = transactions[np.array(unknown, dtype=bool)]
         # Only send if it has transactions
-        if transactions:
-            print(
-                f'{self.address} at {time(self.env)}: {len(transactions)} transactions ready to be sent')
+        if len(transactions):
+            self.env.logger.mempool.debug(
+                self.address, '%s transactions ready to be sent', len(transactions))
             transactions_msg = self.network_message.transactions(transactions)
-            self.env.process(self.broadcast(transactions_msg))
+            self.broadcast(transactions_msg)
 
     def _receive_full_transactions(self, envelope):
         """Handle full tx received. If node is miner store transactions in a pool (ordered by the gas price)"""
-        transactions = envelope.msg.get('transactions')
-        valid_transactions = []
-        for tx in transactions:
-            if self.is_mining:
-                self.transaction_queue.put(tx)
-            else:
-                valid_transactions.append(tx)
-        self.env.process(self.broadcast_transactions(valid_transactions))
+        transactions = envelope.msg.transactions
+        if self.is_mining:
+            self.transaction_queue.put(transactions)
+        else:
+            self.env.process(self.broadcast_transactions(transactions))
 
     ##              ##
     ## Blocks       ##
@@ -170,25 +172,34 @@ class ETHNode(Node):
     def broadcast_new_blocks(self, new_blocks: list):
         """Specify one or more new blocks which have appeared on the network.
         To be maximally helpful, nodes should inform peers of all blocks that
-        they may not be aware of."""
+        they may not be aware of. The blocks are only announced to the peers
+        that do not know them yet."""
         new_blocks_hashes = {}
         for block in new_blocks:
             new_blocks_hashes[block.header.hash] = block.header.number
+        addresses = self._announce_blocks(list(new_blocks_hashes))
+        if not addresses:
+            return
         new_blocks_msg = self.network_message.new_blocks(new_blocks_hashes)
-        self.env.process(self.broadcast(new_blocks_msg))
+        self.broadcast(new_blocks_msg, addresses)
 
     def _receive_new_blocks(self, envelope):
         """Handle new blocks received.
         The destination only receives the hash and number of the block. It is needed to
         ask for the header and body.
         If node is a miner, we need to interrupt the current candidate block mining process"""
-        new_blocks = envelope.msg['new_blocks']
-        print(f'{self.address} at {time(self.env)}: New blocks received {new_blocks}')
+        new_blocks = envelope.msg.new_blocks
+        self.env.logger.network.debug(
+            self.address, 'New blocks received %s', new_blocks)
         # If the block is already known by a node, it does not need to request the block again
         block_numbers = []
         for block_hash, block_number in new_blocks.items():
-            if self.chain.get_block(block_hash) is None:
+            self._mark_block(block_hash, envelope.origin.address)
+            if self.chain.get_block(block_hash) is None and block_hash not in self.temp_headers \
+                    and block_hash not in self.chain.orphans:
                 block_numbers.append(block_number)
+        if not block_numbers:
+            return
         lowest_block_number = min(block_numbers)
         self.request_headers(
             lowest_block_number, len(new_blocks), envelope.origin.address)
@@ -203,8 +214,8 @@ class ETHNode(Node):
 
     def _send_block_headers(self, envelope):
         """Send block headers for any node that request it, identified by the `destination_address`"""
-        block_number = envelope.msg.get('block_number', 0)
-        max_headers = envelope.msg.get('max_headers', 1)
+        block_number = envelope.msg.block_number
+        max_headers = envelope.msg.max_headers
         block_hash = self.chain.get_blockhash_by_number(block_number)
         block_hashes = self.chain.get_blockhashes_from_hash(
             block_hash, max_headers)
@@ -212,20 +223,22 @@ class ETHNode(Node):
         for _block_hash in block_hashes:
             block_header = self.chain.get_block(_block_hash).header
             block_headers.append(block_header)
-        print(
-            f'{self.address} at {time(self.env)}: {len(block_headers)} Block header(s) preapred to send')
+        self.env.logger.network.debug(
+            self.address, '%s Block header(s) prepared to send', len(block_headers))
         block_headers_msg = self.network_message.block_headers(block_headers)
         self.env.process(self.send(envelope.origin.address, block_headers_msg))
 
     def _receive_block_headers(self, envelope):
         """Handle block headers received"""
-        block_headers = envelope.msg.get('block_headers')
+        block_headers = envelope.msg.block_headers
         # Save the header in a temporary list
         hashes = []
         for header in block_headers:
-            self.temp_headers[header.hash] = header
-            hashes.append(header.hash)
-        self.request_bodies(hashes, envelope.origin.address)
+            if self.chain.get_block(header.hash) is None:
+                self.temp_headers[header.hash] = header
+                hashes.append(header.hash)
+        if hashes:
+            self.request_bodies(hashes, envelope.origin.address)
 
     def request_bodies(self, hashes: list, destination_address: str):
         """Request a node (identified by the `destination_address`) to return block bodies.
@@ -240,26 +253,44 @@ class ETHNode(Node):
         In `envelope.msg.hashes` we obtain a list of hashes of block bodies being requested.
         """
         block_bodies = {}
-        for block_hash in envelope.msg.get('hashes'):
+        for block_hash in envelope.msg.hashes:
             block = self.chain.get_block(block_hash)
-            block_bodies[block.header.hash] = block.transactions
-        print(
-            f'{self.address} at {time(self.env)}: {len(block_bodies)} Block bodies(s) preapred to send')
+            if block is not None:
+                block_bodies[block.header.hash] = block.transactions
+        self.env.logger.network.debug(
+            self.address, '%s Block bodies(s) prepared to send', len(block_bodies))
         block_bodies_msg = self.network_message.block_bodies(block_bodies)
         self.env.process(self.send(envelope.origin.address, block_bodies_msg))
 
     def _receive_block_bodies(self, envelope):
         """Handle block bodies received
         Assemble the block header in a temporary list with the block body received and
-        insert it in the blockchain"""
+        insert it in the blockchain. A block added is announced to the peers that do not
+        know it, and the ancestors of a block whose parent is unknown are requested to the
+        peer that sent it."""
+        origin = envelope.origin.address
         block_hashes = []
-        block_bodies = envelope.msg.get('block_bodies')
+        block_bodies = envelope.msg.block_bodies
         for block_hash, block_txs in block_bodies.items():
-            block_hashes.append(block_hash[:8])
-            if block_hash in self.temp_headers:
-                header = self.temp_headers.get(block_hash)
-                new_block = Block(header, block_txs)
-                if self.chain.add_block(new_block):
-                    del self.temp_headers[block_hash]
-                    print(
-                        f'{self.address} at {time(self.env)}: Block assembled and added to the tip of the chain  {new_block.header}')
+            block_hashes.append(short_hash(block_hash))
+            self._mark_block(block_hash, origin)
+            header = self.temp_headers.pop(block_hash, None)
+            if header is None or self.chain.get_block(block_hash) is not None:
+                continue
+            new_block = Block(header, block_txs)
+            if self.chain.add_block(new_block):
+                self.env.logger.chain.info(
+                    self.address, 'Block assembled and added to the tip of the chain %s', new_block.header)
+                self._relay_block(new_block)
+            elif block_hash in self.chain.orphans and header.prevhash not in self.temp_headers \
+                    and header.prevhash not in self.chain.orphans:
+                max_headers = min(max(header.number - 1 - self.chain.height, 1), MAX_HEADERS_FETCH)
+                self.request_headers(header.number - 1, max_headers, origin)
+
+    def _relay_block(self, block):
+        """Announces a block added to the chain, and the head of the chain when it changed to
+        another block (e.g. an orphan block connected by it)"""
+        self.broadcast_new_blocks([block])
+        head = self.chain.head
+        if head.header.hash != block.header.hash:
+            self.broadcast_new_blocks([head])
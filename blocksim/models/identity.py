@@ -0,0 +1,65 @@
+import numpy as np
+from blocksim.utils import keccak_256, encode_hex
+
+# Identity of the genesis block when synthetic ids are used. Every node creates its own
+# genesis block, but all of them represent the same block
+GENESIS_ID = 0
+
+_synthetic_ids = False
+_next_id = GENESIS_ID + 1
+
+
+def use_synthetic_ids(enabled: bool):
+    """Selects how blocks and transactions are identified during the simulation.
+
+    By default, they are identified by the Keccak 256 hash of their content. With synthetic
+    ids, each one receives instead an integer taken from a global counter, which is much
+    cheaper to create, store and compare. The counter starts again on every call."""
+    global _synthetic_ids, _next_id
+    _synthetic_ids = enabled
+    _next_id = GENESIS_ID + 1
+
+
+def synthetic_ids_enabled():
+    return _synthetic_ids
+
+
+def next_id():
+    """Returns the next integer id from the global counter"""
+    return _reserve(1)
+
+
+def _reserve(n):
+    global _next_id
+    first = _next_id
+    _next_id += n
+    return first
+
+
+def block_id(header):
+    """Returns the identity of a block `header`"""
+    if _synthetic_ids:
+        return GENESIS_ID if header.number == 0 else next_id()
+    return encode_hex(keccak_256(header.encode()))
+
+
+def object_id(value):
+    """Returns the 64-bit integer form of a block or transaction identity. Keccak 256 hashes
+    are reduced to their first 8 bytes, as the ids of the transaction batches."""
+    if isinstance(value, str):
+        return int(value[:16], 16)
+    return int(value)
+
+
+def transaction_ids(n: int):
+    """Returns an array with the 64-bit integer ids of `n` new transactions.
+
+    With synthetic ids they are taken in a block from the global counter. Otherwise, as
+    the transactions of a batch have no content of their own, each id is the first 8 bytes
+    of the Keccak 256 hash of a unique sequence number."""
+    first = _reserve(n)
+    if _synthetic_ids:
+        return np.arange(first, first + n, dtype=np.uint64)
+    digests = b''.join(keccak_256(sequence.to_bytes(8, byteorder='big'))[:8]
+                       for sequence in range(first, first + n))
+    return np.frombuffer(digests, dtype='>u8').astype(np.uint64)
@@ -0,0 +1,193 @@
+import math
+from collections import OrderedDict
+from blocksim.models.identity import object_id
+
+_MASK_64 = (1 << 64) - 1
+
+
+def _mix(value: int):
+    """Scrambles a 64-bit integer (the finalizer of SplitMix64), so consecutive synthetic ids
+    are spread over the bits of a filter as well as hashes"""
+    value = (value ^ (value >> 30)) * 0xbf58476d1ce4e5b9 & _MASK_64
+    value = (value ^ (value >> 27)) * 0x94d049bb133111eb & _MASK_64
+    return value ^ (value >> 31)
+
+
+class ObjectRegistry:
+    """Gives each block or transaction of the network a dense integer index, in the order
+    they are first seen, so the state kept for them by each peer can be indexed by position.
+
+    A single registry is owned by the `Network` and shared by all its nodes.
+    """
+
+    __slots__ = ('_indexes',)
+
+    def __init__(self):
+        self._indexes = {}
+
+    def index(self, item):
+        """Returns the index of an `item`, registering it when it is seen for the first time"""
+        index = self._indexes.get(item)
+        if index is None:
+            index = self._indexes[item] = len(self._indexes)
+        return index
+
+    def get(self, item):
+        """Returns the index of an `item`, or None if it was never registered"""
+        return self._indexes.get(item)
+
+    def __len__(self):
+        return len(self._indexes)
+
+
+class LRUInventory:
+    """The blocks or transactions known by a peer, remembering the last `capacity` ones.
+
+    When the inventory is full, the least recently added item is forgotten.
+
+    :param int capacity: the maximum number of items remembered
+    """
+
+    __slots__ = ('capacity', '_items')
+
+    def __init__(self, capacity: int):
+        if capacity < 1:
+            raise ValueError(f'The capacity of an inventory must be positive, got {capacity}')
+        self.capacity = capacity
+        self._items = OrderedDict()
+
+    def add(self, item):
+        items = self._items
+        if item in items:
+            items.move_to_end(item)
+            return
+        if len(items) >= self.capacity:
+            items.popitem(last=False)
+        items[item] = None
+
+    def __contains__(self, item):
+        return item in self._items
+
+    def __len__(self):
+        return len(self._items)
+
+
+class RollingBloomFilter:
+    """The blocks or transactions known by a peer, as a rolling Bloom filter (like the
+    `CRollingBloomFilter` of Bitcoin Core), with a fixed memory footprint.
+
+    The items are added to the current generation, a Bloom filter sized for `capacity`
+    items. When it is full, it becomes the previous generation, replacing the oldest one, and
+    a new empty generation is started. An item is known if it is in any of the two
+    generations, so the last `capacity` items added are always remembered. An item never
+    added is reported as known with a probability of at most about twice the
+    `false_positive_rate`.
+
+    :param int capacity: the number of items added that are always remembered
+    :param float false_positive_rate: the false positive rate of each generation
+    """
+
+    __slots__ = ('capacity', 'false_positive_rate', 'hash_functions', 'bits',
+                 '_current', '_previous', '_count')
+
+    def __init__(self, capacity: int, false_positive_rate=1e-6):
+        if capacity < 1:
+            raise ValueError(f'The capacity of an inventory must be positive, got {capacity}')
+        if not 0 < false_positive_rate < 1:
+            raise ValueError(
+                f'The false positive rate must be between 0 and 1, got {false_positive_rate}')
+        self.capacity = capacity
+        self.false_positive_rate = false_positive_rate
+        # The optimal number of hash functions and bits of a Bloom filter
+        self.hash_functions = max(1, round(-math.log2(false_positive_rate)))
+        self.bits = math.ceil(-capacity * math.log(false_positive_rate) / math.log(2) ** 2)
+        self._current = bytearray((self.bits + 7) // 8)
+        self._previous = bytearray(len(self._current))
+        self._count = 0
+
+    def _positions(self, item):
+        # Double hashing: the positions are h1 + i * h2, with two halves of the mixed id
+        value = _mix(object_id(item))
+        h1, h2 = value & 0xffffffff, (value >> 32) | 1
+        return [(h1 + i * h2) % self.bits for i in range(self.hash_functions)]
+
+    def add(self, item):
+        if self._count >= self.capacity:
+            self._previous = self._current
+            self._current = bytearray(len(self._previous))
+            self._count = 0
+        current = self._current
+        for position in self._positions(item):
+            current[position >> 3] |= 1 << (position & 7)
+        self._count += 1
+
+    def __contains__(self, item):
+        positions = self._positions(item)
+        for generation in (self._current, self._previous):
+            if all(generation[position >> 3] & (1 << (position & 7)) for position in positions):
+                return True
+        return False
+
+    def __len__(self):
+        """The number of items added to the current generation"""
+        return self._count
+
+
+class BitsetInventory:
+    """The blocks or transactions known by a peer, as a bitset indexed by the position of each
+    item in the `ObjectRegistry` of the network.
+
+    Each item takes a single bit and is never forgotten, so the `capacity` is not used. The
+    bitset grows as new items are registered in the network.
+
+    :param int capacity: not used, all the items added are remembered
+    :param registry: the `ObjectRegistry` of the network
+    """
+
+    __slots__ = ('_registry', '_bits', '_count')
+
+    def __init__(self, capacity: int, registry: ObjectRegistry):
+        self._registry = registry
+        self._bits = bytearray(max(len(registry), 64) // 8)
+        self._count = 0
+
+    def add(self, item):
+        index = self._registry.index(item)
+        byte = index >> 3
+        if byte >= len(self._bits):
+            self._bits.extend(bytes(max(byte + 1, 2 * len(self._bits)) - len(self._bits)))
+        mask = 1 << (index & 7)
+        if not self._bits[byte] & mask:
+            self._bits[byte] |= mask
+            self._count += 1
+
+    def __contains__(self, item):
+        index = self._registry.get(item)
+        if index is None or index >> 3 >= len(self._bits):
+            return False
+        return bool(self._bits[index >> 3] & (1 << (index & 7)))
+
+    def __len__(self):
+        return self._count
+
+
+KNOWN_INVENTORIES = {
+    'lru': LRUInventory,
+    'bloom': RollingBloomFilter,
+    'bitset': BitsetInventory
+}
+
+
+def known_inventory(config: dict, capacity: int, registry: ObjectRegistry = None):
+    """Creates the structure described in `config` (e.g. ``{'name': 'bloom',
+    'false_positive_rate': 1e-6}``) to remember up to `capacity` blocks or transactions.
+    The ``bitset`` structure needs the `registry` of the network."""
+    config = dict(config)
+    name = config.pop('name', 'lru')
+    if name not in KNOWN_INVENTORIES:
+        raise ValueError(f'Unknown known inventory {name}, available: {list(KNOWN_INVENTORIES)}')
+    if name == 'bitset':
+        if registry is None:
+            raise ValueError('A bitset inventory needs the object registry of the network')
+        config['registry'] = registry
+    return KNOWN_INVENTORIES[name](capacity, **config)
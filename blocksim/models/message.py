@@ -0,0 +1,61 @@
+# Message types of the Bitcoin and Ethereum protocols, the code of each one is its position
+# in the tuple plus one
+MESSAGE_TYPES = (
+    'status', 'new_blocks', 'transactions', 'get_headers', 'block_headers',
+    'get_block_bodies', 'block_bodies', 'version', 'verack', 'inv', 'getdata', 'tx', 'block', 'notfound')
+MESSAGE_CODES = {name: code for code, name in enumerate(MESSAGE_TYPES, start=1)}
+
+# Ethereum
+STATUS = MESSAGE_CODES['status']
+NEW_BLOCKS = MESSAGE_CODES['new_blocks']
+TRANSACTIONS = MESSAGE_CODES['transactions']
+GET_HEADERS = MESSAGE_CODES['get_headers']
+BLOCK_HEADERS = MESSAGE_CODES['block_headers']
+GET_BLOCK_BODIES = MESSAGE_CODES['get_block_bodies']
+BLOCK_BODIES = MESSAGE_CODES['block_bodies']
+# Bitcoin
+VERSION = MESSAGE_CODES['version']
+VERACK = MESSAGE_CODES['verack']
+INV = MESSAGE_CODES['inv']
+GETDATA = MESSAGE_CODES['getdata']
+TX = MESSAGE_CODES['tx']
+BLOCK = MESSAGE_CODES['block']
+NOTFOUND = MESSAGE_CODES['notfound']
+
+
+class NetworkMessage:
+    """Defines the base of the network messages exchanged by the nodes.
+
+    Each type of message is a subclass with its own fields, identified by an integer `code`
+    from `MESSAGE_CODES` (shared by all the messages of the type), and a `size` in megabytes.
+
+    :param float size: the size of the message in megabytes (MB)
+    """
+
+    __slots__ = ('size',)
+
+    code = 0
+
+    def __init__(self, size: float):
+        self.size = size
+
+    @property
+    def id(self):
+        """The name of the type of message (e.g. ``transactions``)"""
+        return MESSAGE_TYPES[self.code - 1]
+
+    def __repr__(self):
+        return f'<{self.__class__.__name__}(size:{self.size})>'
+
+
+class Envelope:
+    """A message in transit from the `origin` node to the `destination` node, created at the
+    simulation time `timestamp`"""
+
+    __slots__ = ('msg', 'timestamp', 'destination', 'origin')
+
+    def __init__(self, msg: NetworkMessage, timestamp: float, destination, origin):
+        self.msg = msg
+        self.timestamp = timestamp
+        self.destination = destination
+        self.origin = origin
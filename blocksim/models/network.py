@@ -1,9 +1,17 @@
-import scipy
 from simpy import Store
-from blocksim.utils import get_random_values, time, get_latency_delay
+from blocksim.utils import get_latency_delay
+from blocksim.models.inventory import ObjectRegistry
+from blocksim.models.block_store import BlockStore
 
 
 class Network:
+    """The network that all the nodes join.
+
+    The network keeps a `registry` of the blocks and transactions seen by its nodes, which
+    gives each one a dense integer index shared by all the nodes. With the ``shared`` block
+    store, it also keeps the only copy of each block, for the chains of all its nodes.
+    """
+
     def __init__(self, env, name):
         self.env = env
         self.name = name
@@ -12,13 +20,32 @@ class Network:
         self._nodes = {}
         self._list_nodes = []
         self._list_probabilities = []
+        self.registry = ObjectRegistry()
+        self._block_store = None
+        self.env.report.add_snapshot('chains', self.chain_summaries)
 
     def get_node(self, address):
         return self._nodes.get(address)
 
+    def chain_summaries(self):
+        """Returns the summary of the chain of each node, by address"""
+        return {address: node.chain.summary() for address, node in self._nodes.items()}
+
     def add_node(self, node):
+        """Adds a `node` to the network and returns its id, the position in which it was added"""
+        node_id = len(self._nodes)
         self._nodes[node.address] = node
         self.total_hashrate += node.hashrate
+        return node_id
+
+    def block_store(self):
+        """Returns the `BlockStore` for the chain of a new node: the store shared by all the
+        nodes, or a new store for the node alone"""
+        if self.env.config['simulation']['block_store'] == 'shared':
+            if self._block_store is None:
+                self._block_store = BlockStore(self.env.databases.create())
+            return self._block_store
+        return BlockStore(self.env.databases.create())
 
     def _init_lists(self):
         for add, node in self._nodes.items():
@@ -45,48 +72,67 @@ class Network:
         """
         self._init_lists()
         while True:
-            time_between_blocks = round(get_random_values(
-                self.env.delays['time_between_blocks_seconds'])[0], 2)
+            time_between_blocks = self.env.delays['time_between_blocks_seconds'].get()
             yield self.env.timeout(time_between_blocks)
             orphan_blocks_probability = self.env.config[self.blockchain]['orphan_blocks_probability']
-            simulate_orphan_blocks = scipy.random.choice(
-                [True, False], 1, p=[orphan_blocks_probability, 1-orphan_blocks_probability])[0]
+            simulate_orphan_blocks = self.env.rng.random() < orphan_blocks_probability
             if simulate_orphan_blocks:
-                selected_nodes = scipy.random.choice(
+                selected_nodes = self.env.rng.choice(
                     self._list_nodes, 2, replace=False, p=self._list_probabilities)
                 for selected_node in selected_nodes:
                     self._build_new_block(selected_node)
             else:
-                selected_node = scipy.random.choice(
+                selected_node = self.env.rng.choice(
                     self._list_nodes, 1, replace=False, p=self._list_probabilities)[0]
                 self._build_new_block(selected_node)
 
     def _build_new_block(self, node):
-        print(
-            f'Network at {time(self.env)}: Node {node.address} selected to broadcast his candidate block')
+        self.env.logger.consensus.info(
+            'Network', 'Node %s selected to broadcast his candidate block', node.address)
         # Give orders to the selected node to broadcast his candidate block
         node.build_new_block()
 
 
+# How a connection delivers the envelopes after the latency delay
+CONNECTION_DELIVERY_MODES = ('scheduled', 'process')
+
+
 class Connection:
-    """This class represents the propagation through a Connection."""
+    """This class represents the propagation through a Connection.
+
+    Each envelope put in the connection is delivered to its `store` after a latency delay.
+    With the ``scheduled`` delivery mode, the delivery is a single timeout event with a
+    callback, scheduled in the SimPy event queue. With the ``process`` mode, a new SimPy
+    process is started for each envelope, waiting for the latency delay. In both modes the
+    envelopes are taken from the connection with `get`, as from a `Store`."""
 
     def __init__(self, env, origin_node, destination_node):
         self.env = env
         self.store = Store(env)
         self.origin_node = origin_node
         self.destination_node = destination_node
+        self._scheduled = env.config['simulation']['connection_delivery'] == 'scheduled'
 
     def latency(self, envelope):
         latency_delay = get_latency_delay(
-            self.env, self.origin_node.location, self.destination_node.location)
+            self.env, self.origin_node.location_id, self.destination_node.location_id)
         yield self.env.timeout(latency_delay)
         self.store.put(envelope)
 
     def put(self, envelope):
-        print(
-            f'{envelope.origin.address} at {envelope.timestamp}: Message (ID: {envelope.msg["id"]}) sent with {envelope.msg["size"]} MB with a destination: {envelope.destination.address}')
-        self.env.process(self.latency(envelope))
+        self.env.logger.network.debug(
+            envelope.origin.address, 'Message (ID: %s) sent with %s MB with a destination: %s',
+            envelope.msg.id, envelope.msg.size, envelope.destination.address)
+        if self._scheduled:
+            latency_delay = get_latency_delay(
+                self.env, self.origin_node.location_id, self.destination_node.location_id)
+            delivery = self.env.timeout(latency_delay, envelope)
+            delivery.callbacks.append(self._deliver)
+        else:
+            self.env.process(self.latency(envelope))
+
+    def _deliver(self, delivery):
+        self.store.put(delivery.value)
 
     def get(self):
         return self.store.get()
@@ -1,15 +1,19 @@
-from collections import namedtuple
+import itertools
+import numpy as np
 from blocksim.models.network import Connection, Network
 from blocksim.models.chain import Chain
 from blocksim.models.consensus import Consensus
-from blocksim.utils import get_received_delay, get_sent_delay, get_latency_delay, time
-
-Envelope = namedtuple('Envelope', 'msg, timestamp, destination, origin')
+from blocksim.models.inventory import known_inventory
+from blocksim.models.message import Envelope, TRANSACTIONS, BLOCK_HEADERS, BLOCK_BODIES, NEW_BLOCKS, TX, BLOCK
+from blocksim.utils import get_received_delay, get_sent_delay, get_sent_delays, get_concurrent_sent_delays, get_latency_delay
+from blocksim.trace import SEND, BROADCAST, RECEIVE
 
 # Maximum transactions hashes to keep in the known list (prevent DOS)
 MAX_KNOWN_TXS = 30000
 # Maximum block hashes to keep in the known list (prevent DOS)
 MAX_KNOWN_BLOCKS = 1024
+# How the uplink of a node is used to broadcast a message to its peers
+BROADCAST_UPLINK_MODELS = ('sequential', 'concurrent')
 
 
 class Node:
@@ -21,9 +25,10 @@ class Node:
     not any mechanism to discover nodes.
 
     To properly stimulate a real world scenario, the node model needs to know the geographic
-    `location`.
+    `location`. The `location_id` indexes the delays measured between locations.
 
-    In order to a node to be identified in the network simulation, is needed to have an `address`
+    In order to a node to be identified in the network simulation, is needed to have an `address`.
+    The network also gives each node an integer `node_id`, used in the event traces.
     """
 
     def __init__(self,
@@ -36,13 +41,14 @@ class Node:
         self.env = env
         self.network = network
         self.location = location
+        self.location_id = env.location_ids[location]
         self.address = address
         self.chain = chain
         self.consensus = consensus
         self.active_sessions = {}
         self.connecting = None
         # Join the node to the network
-        self.network.add_node(self)
+        self.node_id = self.network.add_node(self)
         # Set the monitor to count the forks during the simulation
         key = f'forks_{address}'
         self.env.data[key] = 0
@@ -54,17 +60,11 @@ class Node:
             # Ignore when a node is trying to connect to itself
             if node.address != self.address:
                 connection = Connection(self.env, self, node)
-
-                # Set the bases to monitor the block & TX propagation
-                self.env.data['block_propagation'].update({
-                    f'{self.address}_{node.address}': {}})
-                self.env.data['tx_propagation'].update({
-                    f'{self.address}_{node.address}': {}})
-
+                inventory = self.env.config['simulation']['known_inventory']
                 self.active_sessions[node.address] = {
                     'connection': connection,
-                    'knownTxs': {''},
-                    'knownBlocks': {''}
+                    'knownTxs': known_inventory(inventory, MAX_KNOWN_TXS, self.network.registry),
+                    'knownBlocks': known_inventory(inventory, MAX_KNOWN_BLOCKS, self.network.registry)
                 }
                 self.connecting = self.env.process(
                     self._connecting(node, connection))
@@ -78,7 +78,7 @@ class Node:
         origin_node = connection.origin_node
         destination_node = connection.destination_node
         latency = get_latency_delay(
-            self.env, origin_node.location, destination_node.location)
+            self.env, origin_node.location_id, destination_node.location_id)
         tcp_handshake_delay = 3*latency
         yield self.env.timeout(tcp_handshake_delay)
         self.env.process(destination_node.listening_node(connection))
@@ -86,64 +86,55 @@ class Node:
     def _mark_block(self, block_hash: str, node_address: str):
         """Marks a block as known for a specific node, ensuring that it will never be
         propagated again."""
-        node = self.active_sessions.get(node_address)
-        known_blocks = node.get('knownBlocks')
-        while len(known_blocks) >= MAX_KNOWN_BLOCKS:
-            known_blocks.pop()
-        known_blocks.add(block_hash)
-        node['knownBlocks'] = known_blocks
-        self.active_sessions[node_address] = node
+        self.active_sessions[node_address]['knownBlocks'].add(block_hash)
+
+    def _announce_blocks(self, block_hashes: list):
+        """Returns the addresses of the peers that do not know some of the blocks, marking
+        the blocks as known by them, so each block is announced once to each peer"""
+        addresses = []
+        for node_address, node in self.active_sessions.items():
+            known_blocks = node['knownBlocks']
+            if any(block_hash not in known_blocks for block_hash in block_hashes):
+                addresses.append(node_address)
+                for block_hash in block_hashes:
+                    known_blocks.add(block_hash)
+        return addresses
 
     def _mark_transaction(self, tx_hash: str, node_address: str):
         """Marks a transaction as known for a specific node, ensuring that it will never be
         propagated again."""
-        node = self.active_sessions.get(node_address)
-        known_txs = node.get('knownTxs')
-        while len(known_txs) >= MAX_KNOWN_TXS:
-            known_txs.pop()
-        known_txs.add(tx_hash)
-        node['knownTxs'] = known_txs
-        self.active_sessions[node_address] = node
+        self.active_sessions[node_address]['knownTxs'].add(tx_hash)
 
     def _read_envelope(self, envelope):
-        print(
-            f'{self.address} at {time(self.env)}: Receive a message (ID: {envelope.msg["id"]}) created at {envelope.timestamp} from {envelope.origin.address}')
+        self.env.logger.network.debug(
+            self.address, 'Receive a message (ID: %s) created at %s from %s',
+            envelope.msg.id, envelope.timestamp, envelope.origin.address)
 
     def listening_node(self, connection):
         while True:
             # Get the messages from  connection
             envelope = yield connection.get()
-            origin_loc = envelope.origin.location
-            dest_loc = envelope.destination.location
-            message_size = envelope.msg['size']
+            origin_loc = envelope.origin.location_id
+            dest_loc = envelope.destination.location_id
+            message_size = envelope.msg.size
             received_delay = get_received_delay(
                 self.env, message_size, origin_loc, dest_loc)
             yield self.env.timeout(received_delay)
+            if self.env.trace is not None:
+                self.env.trace.message(
+                    self.env.now, RECEIVE, envelope.origin.node_id, envelope.destination.node_id, envelope.msg)
 
             # Monitor the transaction propagation on Ethereum
-            if envelope.msg['id'] == 'transactions':
-                tx_propagation = self.env.data['tx_propagation'][
-                    f'{envelope.origin.address}_{envelope.destination.address}']
-                txs = {}
-                for tx in envelope.msg['transactions']:
-                    initial_time = tx_propagation.get(tx.hash[:8], None)
-                    if initial_time is not None:
-                        propagation_time = self.env.now - initial_time
-                        txs.update({f'{tx.hash[:8]}': propagation_time})
-                self.env.data['tx_propagation'][f'{envelope.origin.address}_{envelope.destination.address}'].update(
-                    txs)
+            if envelope.msg.code == TRANSACTIONS:
+                transactions = envelope.msg.transactions
+                self.env.metrics.received(
+                    'tx', envelope.origin, envelope.destination, int(transactions.ids[0]),
+                    self.env.now, transactions.ids)
             # Monitor the block propagation on Ethereum
-            if envelope.msg['id'] == 'block_bodies':
-                block_propagation = self.env.data['block_propagation'][
-                    f'{envelope.origin.address}_{envelope.destination.address}']
-                blocks = {}
-                for block_hash, _ in envelope.msg['block_bodies'].items():
-                    initial_time = block_propagation.get(block_hash[:8], None)
-                    if initial_time is not None:
-                        propagation_time = self.env.now - initial_time
-                        blocks.update({f'{block_hash[:8]}': propagation_time})
-                self.env.data['block_propagation'][f'{envelope.origin.address}_{envelope.destination.address}'].update(
-                    blocks)
+            if envelope.msg.code == BLOCK_BODIES:
+                for block_hash in envelope.msg.block_bodies:
+                    self.env.metrics.received(
+                        'block', envelope.origin, envelope.destination, block_hash, self.env.now)
 
             self._read_envelope(envelope)
 
@@ -155,59 +146,94 @@ class Node:
         origin_node = active_connection.origin_node
         destination_node = active_connection.destination_node
 
-        # Perform block validation before sending
+        # Perform block validation before sending, with one delay for all the items
         # For Ethereum it performs validation when receives the header:
-        if msg['id'] == 'block_headers':
-            for header in msg['block_headers']:
-                delay = self.consensus.validate_block()
-                yield self.env.timeout(delay)
+        if msg.code == BLOCK_HEADERS:
+            yield self.env.timeout(self.consensus.validate_blocks(len(msg.block_headers)))
         # For Bitcoin it performs validation when receives the full block:
-        if msg['id'] == 'block':
-            delay = self.consensus.validate_block()
-            yield self.env.timeout(delay)
+        if msg.code == BLOCK:
+            yield self.env.timeout(self.consensus.validate_block())
         # Perform transaction validation before sending
         # For Ethereum:
-        if msg['id'] == 'transactions':
-            for tx in msg['transactions']:
-                delay = self.consensus.validate_transaction()
-                yield self.env.timeout(delay)
+        if msg.code == TRANSACTIONS:
+            yield self.env.timeout(self.consensus.validate_transactions(len(msg.transactions)))
         # For Bitcoin:
-        if msg['id'] == 'tx':
-            delay = self.consensus.validate_transaction()
-            yield self.env.timeout(delay)
+        if msg.code == TX:
+            yield self.env.timeout(self.consensus.validate_transaction())
 
         upload_transmission_delay = get_sent_delay(
-            self.env, msg['size'], origin_node.location, destination_node.location)
+            self.env, msg.size, origin_node.location_id, destination_node.location_id)
         yield self.env.timeout(upload_transmission_delay)
 
-        envelope = Envelope(msg, time(self.env), destination_node, origin_node)
+        envelope = Envelope(msg, self.env.now, destination_node, origin_node)
+        if self.env.trace is not None:
+            self.env.trace.message(
+                self.env.now, SEND, origin_node.node_id, destination_node.node_id, msg)
         active_connection.put(envelope)
 
-    def broadcast(self, msg):
-        """Broadcast a message to all nodes with an active session"""
-        for add, node in self.active_sessions.items():
-            connection = node['connection']
-            origin_node = connection.origin_node
-            destination_node = connection.destination_node
-
-            # Monitor the transaction propagation on Ethereum
-            if msg['id'] == 'transactions':
-                txs = {}
-                for tx in msg['transactions']:
-                    txs.update({f'{tx.hash[:8]}': self.env.now})
-                self.env.data['tx_propagation'][f'{origin_node.address}_{destination_node.address}'].update(
-                    txs)
-            # Monitor the block propagation on Ethereum
-            if msg['id'] == 'new_blocks':
-                blocks = {}
-                for block_hash in msg['new_blocks']:
-                    blocks.update({f'{block_hash[:8]}': self.env.now})
-                self.env.data['block_propagation'][f'{origin_node.address}_{destination_node.address}'].update(
-                    blocks)
-
-            upload_transmission_delay = get_sent_delay(
-                self.env, msg['size'], origin_node.location, destination_node.location)
-            yield self.env.timeout(upload_transmission_delay)
-            envelope = Envelope(msg, time(self.env),
-                                destination_node, origin_node)
-            connection.put(envelope)
+    def broadcast(self, msg, addresses=None):
+        """Broadcast a message to all nodes with an active session, or only to the ones in
+        `addresses`.
+
+        The upload delays to all the destinations are sampled at once, and each delivery is
+        scheduled as an event, without a process for the broadcast. With the ``sequential``
+        uplink model the message is uploaded to one destination after the other. With the
+        ``concurrent`` model it is uploaded to all of them at the same time, sharing the
+        bandwidth of the uplink."""
+        sessions = self.active_sessions.values() if addresses is None else (
+            self.active_sessions[address] for address in addresses)
+        connections = [node['connection'] for node in sessions]
+        if not connections:
+            return
+        destinations = np.fromiter(
+            (connection.destination_node.location_id for connection in connections),
+            dtype=np.intp, count=len(connections))
+        upload_transmission_delays = get_sent_delays(
+            self.env, msg.size, self.location_id, destinations)
+        if self.env.config['simulation']['broadcast_uplink'] == 'concurrent':
+            self._monitor_broadcast(msg, connections, [self.env.now] * len(connections))
+            delivery_delays = get_concurrent_sent_delays(upload_transmission_delays)
+            for delivery_delay, connection in zip(delivery_delays.tolist(), connections):
+                delivery = self.env.timeout(delivery_delay, connection)
+                delivery.callbacks.append(
+                    lambda event: self._deliver_broadcast(msg, event.value))
+        else:
+            upload_transmission_delays = upload_transmission_delays.tolist()
+            # Each upload starts when the previous one ends
+            start_times = list(itertools.accumulate(
+                upload_transmission_delays[:-1], initial=self.env.now))
+            self._monitor_broadcast(msg, connections, start_times)
+            self._schedule_sequential_upload(msg, connections, upload_transmission_delays, 0)
+
+    def _schedule_sequential_upload(self, msg, connections, upload_transmission_delays, i):
+        def deliver(event):
+            self._deliver_broadcast(msg, connections[i])
+            if i + 1 < len(connections):
+                self._schedule_sequential_upload(
+                    msg, connections, upload_transmission_delays, i + 1)
+        delivery = self.env.timeout(upload_transmission_delays[i])
+        delivery.callbacks.append(deliver)
+
+    def _deliver_broadcast(self, msg, connection):
+        origin_node = connection.origin_node
+        destination_node = connection.destination_node
+        envelope = Envelope(msg, self.env.now, destination_node, origin_node)
+        if self.env.trace is not None:
+            self.env.trace.message(
+                self.env.now, BROADCAST, origin_node.node_id, destination_node.node_id, msg)
+        connection.put(envelope)
+
+    def _monitor_broadcast(self, msg, connections, start_times):
+        """Marks the objects of a broadcast message as sent to each destination, at the time
+        the upload to the destination starts"""
+        destinations = [connection.destination_node for connection in connections]
+        # Monitor the transaction propagation on Ethereum. The transactions of a
+        # message are sent together, so only the first one is marked
+        if msg.code == TRANSACTIONS:
+            self.env.metrics.sent_many(
+                'tx', self, destinations, int(msg.transactions.ids[0]), start_times)
+        # Monitor the block propagation on Ethereum
+        if msg.code == NEW_BLOCKS:
+            for block_hash in msg.new_blocks:
+                self.env.metrics.sent_many(
+                    'block', self, destinations, block_hash, start_times)
@@ -0,0 +1,72 @@
+import numpy as np
+from blocksim.models import identity
+
+
+class TransactionBatch:
+    """ Defines a batch of transactions, stored by columns instead of one object per transaction.
+
+    Each column is a NumPy array with one entry per transaction:
+
+    :param ids: the 64-bit integer id of each transaction, used as its hash
+    :param fee: the fee destinated to the node that will insert the transaction on the chain
+    :param gasprice: the price of gas (in wei) the originator is willing to pay (Ethereum only)
+    :param startgas: the maximum amount of gas the originator is willing to pay (Ethereum only)
+    :param created_at: the simulation time when the transaction was created
+
+    Indexing a batch with a slice returns a new batch that is a view over the same arrays,
+    so the transactions can be relayed, queued and included in blocks without being copied.
+    As the same arrays are shared by every node, they are made read only: a transaction is
+    immutable once created.
+    """
+
+    __slots__ = ('ids', 'fee', 'gasprice', 'startgas', 'created_at')
+
+    def __init__(self, ids, fee, gasprice, startgas, created_at):
+        self.ids = ids
+        self.fee = fee
+        self.gasprice = gasprice
+        self.startgas = startgas
+        self.created_at = created_at
+        for column in self.__slots__:
+            getattr(self, column).flags.writeable = False
+
+    @classmethod
+    def create(cls, n: int, created_at: float, fee=0, gasprice=0, startgas=0):
+        """Creates a batch of `n` new transactions with the same fee and gas"""
+        return cls(identity.transaction_ids(n),
+                   np.full(n, fee, dtype=np.int64),
+                   np.full(n, gasprice, dtype=np.int64),
+                   np.full(n, startgas, dtype=np.int64),
+                   np.full(n, created_at, dtype=np.float64))
+
+    @classmethod
+    def empty(cls):
+        return cls.create(0, 0.0)
+
+    @classmethod
+    def concatenate(cls, batches: list):
+        """Joins a list of batches in a single batch"""
+        if len(batches) == 1:
+            return batches[0]
+        if not batches:
+            return cls.empty()
+        return cls(*(np.concatenate([getattr(batch, column) for batch in batches])
+                     for column in cls.__slots__))
+
+    @property
+    def hashes(self):
+        """The ids of the transactions, as a list of Python integers"""
+        return self.ids.tolist()
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __getitem__(self, key):
+        """Returns the transactions selected by a slice, an array of indexes or a boolean mask.
+        An integer selects a batch with a single transaction."""
+        if isinstance(key, int):
+            key = slice(key, key + 1 if key != -1 else None)
+        return TransactionBatch(*(getattr(self, column)[key] for column in self.__slots__))
+
+    def __repr__(self):
+        return f'<{self.__class__.__name__}({len(self)} transactions)>'
@@ -1,27 +1,60 @@
 from collections import deque
+import numpy as np
 from blocksim.utils import time
+from blocksim.models.transaction_batch import TransactionBatch
 
 
 class TransactionQueue():
+    """Queue of the transactions waiting to be included in a block, stored as a queue of
+    `TransactionBatch` slices"""
+
     def __init__(self, env, node, consensus):
         self._env = env
         self._node = node
         self._consensus = consensus
         self._transaction_queue = deque([])
+        self._size = 0
         key = f'{node.address}_number_of_transactions_queue'
         self._env.data[key] = 0
 
-    def put(self, tx):
+    def put(self, transactions: TransactionBatch):
+        if len(transactions) == 0:
+            return
         key = f'{self._node.address}_number_of_transactions_queue'
-        self._env.data[key] += 1
-        self._transaction_queue.append(tx)
+        self._env.data[key] += len(transactions)
+        self._transaction_queue.append(transactions)
+        self._size += len(transactions)
 
-    def get(self):
+    def get(self, n=1):
+        """Removes and returns a batch with at most `n` transactions, in arrival order"""
         # TODO: A delay to retrieve a transaction from the Queue
-        return self._transaction_queue.popleft()
+        batches = []
+        while n > 0 and self._transaction_queue:
+            batch = self._transaction_queue.popleft()
+            if len(batch) > n:
+                self._transaction_queue.appendleft(batch[n:])
+                batch = batch[:n]
+            batches.append(batch)
+            n -= len(batch)
+            self._size -= len(batch)
+        return TransactionBatch.concatenate(batches)
+
+    def get_by_gas(self, gas_limit: int):
+        """Removes and returns the transactions, in arrival order, while the gas of the
+        transactions already taken is below the `gas_limit`"""
+        batches = []
+        gas = 0
+        while gas < gas_limit and self._transaction_queue:
+            batch = self._transaction_queue[0]
+            # A transaction is taken if the gas before it is below the limit
+            gas_before = gas + np.cumsum(batch.startgas) - batch.startgas
+            count = int(np.searchsorted(gas_before, gas_limit, side='left'))
+            batches.append(self.get(count))
+            gas += int(batches[-1].startgas.sum())
+        return TransactionBatch.concatenate(batches)
 
     def is_empty(self):
-        return len(self._transaction_queue) == 0
+        return self._size == 0
 
     def size(self):
-        return len(self._transaction_queue)
+        return self._size
@@ -2,6 +2,7 @@ from ast import literal_eval as make_tuple
 from random import randint
 from blocksim.models.bitcoin.node import BTCNode
 from blocksim.models.ethereum.node import ETHNode
+from blocksim.topology import build_topology
 
 
 class NodeFactory:
@@ -58,9 +59,8 @@ class NodeFactory:
                               miner_location,
                               node_address)
                 non_miners_list.append(new)
-        # Fully connect all the nodes
         nodes_list = miners_list + non_miners_list
-        print(f'NodeFactory: Created {len(nodes_list)} bitcoin nodes')
+        self._world.env.logger.network.info('NodeFactory', 'Created %s bitcoin nodes', len(nodes_list))
         return nodes_list
 
     def create_ethereum_nodes(self, miners, non_miners):
@@ -95,11 +95,23 @@ class NodeFactory:
                               node_address,
                               False)
                 non_miners_list.append(new)
-        # Fully connect all the nodes
         nodes_list = miners_list + non_miners_list
-        print(f'NodeFactory: Created {len(nodes_list)} ethereum nodes')
+        self._world.env.logger.network.info('NodeFactory', 'Created %s ethereum nodes', len(nodes_list))
         return nodes_list
 
+    def connect_nodes(self, nodes_list):
+        """Connects the nodes following the topology of the ``simulation`` section of the
+        configuration, and returns the `Topology` built"""
+        config = self._world.env.config['simulation']['topology']
+        location_ids = latencies = None
+        # Only the geographic topology chooses the peers by their latency
+        if config.get('name') == 'geographic':
+            location_ids = [node.location_id for node in nodes_list]
+            latencies = self._world.env.delays['LATENCIES'].means()
+        topology = build_topology(config, len(nodes_list), self._world.spawn_rng(), location_ids, latencies)
+        topology.connect(nodes_list)
+        return topology
+
     def _check_location(self, miners, non_miners):
         nodes_location = list(miners.keys()) + list(non_miners)
         for location in nodes_location:
@@ -0,0 +1,324 @@
+import os
+import gzip
+import json
+import numpy as np
+
+REPORT_FORMATS = ('json', 'ndjson', 'npz')
+
+# Simulation seconds between two samples of the counters
+DEFAULT_REPORT_INTERVAL = 60
+# Maximum number of records of a stream in each shard
+DEFAULT_CHUNK_SIZE = 10000
+
+MANIFEST = 'manifest.json'
+SUMMARY = 'summary.json'
+
+
+def _default(value):
+    """Serializes the NumPy scalars and arrays found in the report"""
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    return str(value)
+
+
+def _column(values: list):
+    """Returns the `values` of a column as a NumPy array of a fixed dtype, so it is read back
+    without pickle. Missing values (None) are NaN in numeric columns and '' in string columns,
+    and the values of any other column are written as JSON strings."""
+    present = [value for value in values if value is not None]
+    if all(isinstance(value, (bool, int, float, np.number, np.bool_)) for value in present) and present:
+        if len(present) == len(values):
+            return np.array(values)
+        return np.array([np.nan if value is None else value for value in values], dtype=float)
+    if not all(isinstance(value, str) for value in present):
+        values = [None if value is None else json.dumps(value, default=_default) for value in values]
+    return np.array(['' if value is None else value for value in values], dtype=str)
+
+
+def _write_json(path: str, data):
+    # Write to a temporary file first, so a killed simulation never leaves a partial file
+    temp_path = f'{path}.tmp'
+    with open(temp_path, 'w') as f:
+        json.dump(data, f, default=_default)
+    os.replace(temp_path, path)
+
+
+class ReportWriter:
+    """Writes the report of a simulation while it runs.
+
+    The report is made of streams of records (e.g. the ``counters``), written with `write`,
+    and of a summary given when the writer is closed. Every `interval` simulation seconds
+    the scalar counters of ``env.data`` (e.g. ``created_transactions`` or ``forks_*``) are
+    sampled as a record of the ``counters`` stream, and all the streams are flushed.
+
+    With the ``json`` format the streams are kept in memory and the whole report is written
+    to ``report.json`` when the writer is closed. With the ``ndjson`` and ``npz`` formats each
+    flush writes one shard per stream to ``report/``, as gzip compressed newline delimited
+    JSON or as NumPy ``.npz`` columns, and a ``manifest.json`` lists the shards written so far.
+    If the simulation is killed, everything flushed until then can be read with `Report`.
+    With these two formats, the sources added with `add_snapshot` (e.g. the propagation
+    metrics) are also sampled every `interval` as a record of the ``snapshots`` stream, so
+    the summaries only given on close are not lost either.
+
+    :param env: the SimPy environment
+    :param str directory: the directory where the report is written
+    :param str fmt: the format of the report: json, ndjson or npz
+    :param float interval: the simulation seconds between two samples of the counters
+    :param int chunk_size: the maximum number of records of a stream kept in memory
+    """
+
+    def __init__(self, env, directory='output', fmt='json', interval=DEFAULT_REPORT_INTERVAL,
+                 chunk_size=DEFAULT_CHUNK_SIZE):
+        if fmt not in REPORT_FORMATS:
+            raise ValueError(f'Unknown report format {fmt}, available: {REPORT_FORMATS}')
+        if interval <= 0:
+            raise ValueError(f'The report interval must be positive, got {interval}')
+        self._env = env
+        self.format = fmt
+        self.interval = interval
+        self.chunk_size = chunk_size
+        self._streams = {}
+        self._shards = {}
+        self._snapshot_sources = {}
+        self._closed = False
+        if fmt == 'json':
+            self.path = os.path.join(directory, 'report.json')
+            os.makedirs(directory, exist_ok=True)
+        else:
+            self.path = os.path.join(directory, 'report')
+            os.makedirs(self.path, exist_ok=True)
+            self._write_manifest(complete=False)
+
+    def start(self):
+        """Starts sampling the counters during the simulation"""
+        return self._env.process(self._sampling())
+
+    def _sampling(self):
+        while True:
+            self.sample_counters()
+            self.snapshot()
+            self.flush()
+            yield self._env.timeout(self.interval)
+
+    def sample_counters(self):
+        counters = {'time': self._env.now}
+        for key, value in self._env.data.items():
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                counters[key] = value
+        self.write('counters', counters)
+
+    def add_snapshot(self, key: str, source):
+        """Includes the result of calling `source` as `key` in each record of the ``snapshots``
+        stream"""
+        self._snapshot_sources[key] = source
+
+    def snapshot(self):
+        """Samples the snapshot sources as a record of the ``snapshots`` stream. Only the
+        ``ndjson`` and ``npz`` formats write it, as their shards survive a killed simulation."""
+        if self.format == 'json' or not self._snapshot_sources:
+            return
+        snapshot = {'time': self._env.now}
+        for key, source in self._snapshot_sources.items():
+            snapshot[key] = source()
+        self.write('snapshots', snapshot)
+
+    def write(self, stream: str, record: dict):
+        """Appends a `record` to a `stream`"""
+        records = self._streams.setdefault(stream, [])
+        records.append(record)
+        if self.format != 'json' and len(records) >= self.chunk_size:
+            self._write_shard(stream)
+            self._write_manifest(complete=False)
+
+    def flush(self):
+        """Writes the records of every stream kept in memory"""
+        if self.format == 'json':
+            return
+        for stream in list(self._streams):
+            self._write_shard(stream)
+        self._write_manifest(complete=False)
+
+    def close(self, summary: dict):
+        """Writes the records left and the `summary` of the simulation"""
+        if self._closed:
+            return
+        self._closed = True
+        self.sample_counters()
+        if self.format == 'json':
+            _write_json(self.path, {**summary, **self._streams})
+            return
+        self.flush()
+        _write_json(os.path.join(self.path, SUMMARY), summary)
+        self._write_manifest(complete=True)
+
+    def _write_shard(self, stream: str):
+        records = self._streams.get(stream)
+        if not records:
+            return
+        shards = self._shards.setdefault(stream, [])
+        if self.format == 'ndjson':
+            name = f'{stream}-{len(shards):05d}.ndjson.gz'
+            with gzip.open(os.path.join(self.path, name), 'wt') as f:
+                for record in records:
+                    f.write(json.dumps(record, default=_default))
+                    f.write('\n')
+        else:
+            name = f'{stream}-{len(shards):05d}.npz'
+            columns = {}
+            for record in records:
+                for key in record:
+                    columns.setdefault(key, None)
+            np.savez_compressed(os.path.join(self.path, name), **{
+                key: _column([record.get(key) for record in records]) for key in columns})
+        shards.append(name)
+        self._streams[stream] = []
+
+    def _write_manifest(self, complete: bool):
+        _write_json(os.path.join(self.path, MANIFEST), {
+            'format': self.format,
+            'streams': self._shards,
+            'summary': SUMMARY if complete else None,
+            'complete': complete
+        })
+
+
+class Report:
+    """Reads a report written by `ReportWriter` in the ``ndjson`` or ``npz`` format.
+
+    The shards are only read when the records of their stream are requested, one at a time,
+    so a large report can be processed without loading it whole in memory.
+
+    :param str path: the directory with the ``manifest.json`` of the report
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(os.path.join(path, MANIFEST)) as f:
+            self.manifest = json.load(f)
+        self._summary = None
+
+    @property
+    def streams(self):
+        return list(self.manifest['streams'])
+
+    @property
+    def complete(self):
+        """If the simulation ended and the report was closed"""
+        return self.manifest['complete']
+
+    @property
+    def summary(self):
+        if self._summary is None and self.manifest['summary']:
+            with open(os.path.join(self.path, self.manifest['summary'])) as f:
+                self._summary = json.load(f)
+        return self._summary
+
+    def shards(self, stream: str):
+        """Yields the records of each shard of a `stream` as a dictionary of columns"""
+        for name in self.manifest['streams'].get(stream, []):
+            path = os.path.join(self.path, name)
+            if self.manifest['format'] == 'npz':
+                with np.load(path) as shard:
+                    yield {key: shard[key] for key in shard.files}
+            else:
+                records = list(self._read_ndjson(path))
+                keys = {}
+                for record in records:
+                    for key in record:
+                        keys.setdefault(key, None)
+                yield {key: _column([record.get(key) for record in records]) for key in keys}
+
+    def records(self, stream: str):
+        """Yields the records of a `stream`, one dictionary at a time"""
+        for name in self.manifest['streams'].get(stream, []):
+            path = os.path.join(self.path, name)
+            if self.manifest['format'] == 'npz':
+                with np.load(path) as shard:
+                    columns = {key: shard[key].tolist() for key in shard.files}
+                for values in zip(*columns.values()):
+                    yield dict(zip(columns, values))
+            else:
+                yield from self._read_ndjson(path)
+
+    def columns(self, stream: str):
+        """Returns all the records of a `stream` as a dictionary of NumPy arrays"""
+        shards = list(self.shards(stream))
+        keys = {}
+        for shard in shards:
+            for key in shard:
+                keys.setdefault(key, None)
+        return {key: np.concatenate([shard[key] for shard in shards if key in shard]) for key in keys}
+
+    def _read_ndjson(self, path: str):
+        with gzip.open(path, 'rt') as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+
+
+def _common_prefix(a: list, b: list, end: int):
+    """Returns the number of blocks shared by two canonical chains, up to `end`. Each block
+    identifies its parent, so once two chains differ at a height they differ on all the
+    heights above it, and the length of the common prefix can be searched in halves."""
+    low, high = 0, min(len(a), len(b), end)
+    while low < high:
+        middle = (low + high + 1) // 2
+        if a[middle - 1] == b[middle - 1]:
+            low = middle
+        else:
+            high = middle - 1
+    return low
+
+
+def chain_segments(chains: dict):
+    """Splits the canonical chains of several nodes in segments shared between them.
+
+    Receives the hashes of the canonical chain of each node (`chains`, by node address) and
+    returns a list of segments and the last segment of each node. Each segment is a
+    dictionary with the `parent` segment (or None), the heights it covers (`start` and
+    `end`, exclusive) and the `chain` of a node where its hashes can be read. The chain of a
+    node is given by following the parents from its last segment."""
+    segments = []
+    roots = []
+
+    def find(chain: list, split: bool):
+        children = roots
+        height = 0
+        parent = None
+        while True:
+            segment_id = next(
+                (i for i in children if segments[i]['chain'][segments[i]['start']] == chain[height]), None)
+            if segment_id is None:
+                if not split:
+                    raise RuntimeError('The chain was not inserted in the segments')
+                segments.append({'parent': parent, 'start': height, 'end': len(chain),
+                                 'chain': chain, 'children': []})
+                children.append(len(segments) - 1)
+                return len(segments) - 1
+            segment = segments[segment_id]
+            shared = _common_prefix(segment['chain'], chain, segment['end'])
+            if shared < segment['end'] and split:
+                # Move the end of the segment to a new child segment
+                segments.append({'parent': segment_id, 'start': shared, 'end': segment['end'],
+                                 'chain': segment['chain'], 'children': segment['children']})
+                tail_id = len(segments) - 1
+                for child_id in segment['children']:
+                    segments[child_id]['parent'] = tail_id
+                segment['end'] = shared
+                segment['children'] = [tail_id]
+            if len(chain) <= segment['end']:
+                return segment_id
+            height = segment['end']
+            parent = segment_id
+            children = segment['children']
+
+    # Nodes with the same head have the same chain
+    unique = {}
+    for address, chain in chains.items():
+        unique.setdefault(chain[-1], chain)
+    for chain in unique.values():
+        find(chain, split=True)
+    last_segments = {address: find(chain, split=False) for address, chain in chains.items()}
+    return segments, last_segments
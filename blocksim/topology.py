@@ -0,0 +1,228 @@
+import itertools
+import numpy as np
+
+# Maximum attempts to pair the stubs of a random regular graph before starting again
+MAX_PAIRING_ATTEMPTS = 100
+# Maximum restarts when building a random regular graph
+MAX_RESTARTS = 100
+# Batches of random candidates drawn by a Bitcoin node before trying all the nodes
+MAX_CANDIDATE_BATCHES = 4
+# Maximum random topologies built until one connects all the nodes
+MAX_CONNECTED_ATTEMPTS = 100
+
+
+class Topology:
+    """The peer-to-peer connections between the nodes, as an undirected graph.
+
+    The edges are stored compactly in NumPy arrays, in the compressed sparse row format:
+    the neighbors of node ``i`` (its position in the list of nodes) are
+    ``neighbors[offsets[i]:offsets[i + 1]]``, sorted by their position. Nothing is created
+    for an edge until the nodes are connected with `connect`.
+
+    :param int n: the number of nodes
+    :param edges: an array with shape ``(E, 2)`` and one row for each pair of connected nodes
+    """
+
+    __slots__ = ('n', 'edges', '_offsets', '_neighbors')
+
+    def __init__(self, n: int, edges):
+        edges = np.asarray(edges, dtype=np.int32).reshape(-1, 2)
+        if len(edges) and (edges.min() < 0 or edges.max() >= n):
+            raise ValueError(f'The edges of a topology must connect nodes between 0 and {n - 1}')
+        # Keep each undirected edge once, as (lower, higher)
+        edges = np.unique(np.sort(edges, axis=1), axis=0)
+        edges = edges[edges[:, 0] != edges[:, 1]]
+        self.n = n
+        self.edges = edges
+        # Both directions of each edge, sorted by the origin and then by the destination
+        directed = np.concatenate([edges, edges[:, ::-1]])
+        directed = directed[np.lexsort((directed[:, 1], directed[:, 0]))]
+        self._neighbors = directed[:, 1].copy()
+        self._offsets = np.zeros(n + 1, dtype=np.int64)
+        np.cumsum(np.bincount(directed[:, 0], minlength=n), out=self._offsets[1:])
+
+    def neighbors(self, i: int):
+        """Returns the positions of the neighbors of node `i`, as a view of the edges"""
+        return self._neighbors[self._offsets[i]:self._offsets[i + 1]]
+
+    def degree(self, i: int):
+        return int(self._offsets[i + 1] - self._offsets[i])
+
+    def degrees(self):
+        return np.diff(self._offsets)
+
+    def is_connected(self):
+        """Returns True if every node can be reached from any other, with a breadth first
+        search over the edges"""
+        if self.n < 2:
+            return True
+        reached = np.zeros(self.n, dtype=bool)
+        reached[0] = True
+        frontier = np.array([0])
+        while len(frontier):
+            neighbors = np.concatenate([self.neighbors(i) for i in frontier.tolist()])
+            frontier = np.unique(neighbors[~reached[neighbors]])
+            reached[frontier] = True
+        return bool(reached.all())
+
+    def connect(self, nodes: list):
+        """Connects each node with its neighbors. `nodes` must be in the same order used to
+        build the topology"""
+        if len(nodes) != self.n:
+            raise ValueError(f'The topology has {self.n} nodes, got {len(nodes)}')
+        for i, node in enumerate(nodes):
+            node.connect([nodes[j] for j in self.neighbors(i).tolist()])
+
+    def __len__(self):
+        return len(self.edges)
+
+    def __repr__(self):
+        return f'<{self.__class__.__name__}(nodes:{self.n} edges:{len(self.edges)})>'
+
+
+def full_mesh(n: int, rng):
+    """Every node is connected to all the other nodes"""
+    first, second = np.triu_indices(n, k=1)
+    return Topology(n, np.stack([first, second], axis=1))
+
+
+def random_regular(n: int, rng, degree=8):
+    """Every node is connected to `degree` nodes chosen at random.
+
+    The stubs of the nodes are paired at random, rejecting the pairs that would create a
+    loop or a repeated edge, and starting again if the pairing gets stuck."""
+    if degree >= n:
+        raise ValueError(f'A random regular graph with {n} nodes needs a degree lower than {n}')
+    if n * degree % 2:
+        raise ValueError(f'A random regular graph needs an even number of stubs, got {n} x {degree}')
+    for _ in range(MAX_RESTARTS):
+        stubs = np.repeat(np.arange(n), degree).tolist()
+        neighbors = [set() for _ in range(n)]
+        edges = []
+        while stubs:
+            for _ in range(MAX_PAIRING_ATTEMPTS):
+                i, j = rng.integers(len(stubs), size=2).tolist()
+                u, v = stubs[i], stubs[j]
+                if u != v and v not in neighbors[u]:
+                    break
+            else:
+                break
+            neighbors[u].add(v)
+            neighbors[v].add(u)
+            edges.append((u, v))
+            # Remove both stubs, swapping them with the last ones
+            for k in sorted((i, j), reverse=True):
+                stubs[k] = stubs[-1]
+                stubs.pop()
+        if not stubs:
+            return Topology(n, edges)
+    raise RuntimeError(f'Could not build a random regular graph with {n} nodes of degree {degree}')
+
+
+def bitcoin(n: int, rng, outbound=8, max_inbound=125):
+    """Every node opens `outbound` connections to nodes chosen at random, as Bitcoin Core
+    does, and each node accepts at most `max_inbound` connections"""
+    inbound = np.zeros(n, dtype=np.int64)
+    neighbors = [set() for _ in range(n)]
+    edges = []
+    for u in rng.permutation(n).tolist():
+        opened = 0
+        # Draw the candidates in small batches, and only when they are not enough to open
+        # all the connections, try every node in a random order
+        batches = itertools.chain(
+            (rng.integers(n, size=2 * outbound) for _ in range(MAX_CANDIDATE_BATCHES)),
+            (rng.permutation(n) for _ in range(1)))
+        for candidates in batches:
+            candidates = candidates.tolist()
+            for v in candidates:
+                if opened == outbound:
+                    break
+                if v == u or v in neighbors[u] or inbound[v] >= max_inbound:
+                    continue
+                neighbors[u].add(v)
+                neighbors[v].add(u)
+                inbound[v] += 1
+                edges.append((u, v))
+                opened += 1
+            if opened == outbound:
+                break
+    return Topology(n, edges)
+
+
+def geographic(n: int, rng, degree=8, location_ids=None, latencies=None):
+    """Every node opens `degree` connections to nodes chosen at random, with a probability
+    inversely proportional to the mean latency between their locations"""
+    if location_ids is None or latencies is None:
+        raise ValueError('A geographic topology needs the location of the nodes and the latencies')
+    location_ids = np.asarray(location_ids, dtype=np.intp)
+    weights = 1 / np.maximum(np.asarray(latencies, dtype=np.float64), 1e-6)
+    degree = min(degree, n - 1)
+    edges = []
+    for u in range(n):
+        p = weights[location_ids[u], location_ids]
+        p[u] = 0.0
+        chosen = rng.choice(n, size=degree, replace=False, p=p / p.sum())
+        edges.extend((u, v) for v in chosen.tolist())
+    return Topology(n, edges)
+
+
+def small_world(n: int, rng, neighbors=8, rewiring=0.1):
+    """A Watts-Strogatz graph: the nodes are placed in a ring in a random order, each one
+    connected to its `neighbors` closest nodes, and then each edge is rewired to a random
+    node with a probability of `rewiring`"""
+    half = min(neighbors // 2, (n - 1) // 2)
+    if half < 1:
+        raise ValueError(f'A small world graph needs at least 2 neighbors, got {neighbors}')
+    ring = rng.permutation(n)
+    adjacency = [set() for _ in range(n)]
+    edges = []
+    for offset in range(1, half + 1):
+        for position in range(n):
+            u, v = int(ring[position]), int(ring[(position + offset) % n])
+            adjacency[u].add(v)
+            adjacency[v].add(u)
+            edges.append([u, v])
+    for edge in edges:
+        if rng.random() < rewiring:
+            u, v = edge
+            w = int(rng.integers(n))
+            if w == u or w in adjacency[u]:
+                continue
+            adjacency[u].discard(v)
+            adjacency[v].discard(u)
+            adjacency[u].add(w)
+            adjacency[w].add(u)
+            edge[1] = w
+    return Topology(n, edges)
+
+
+TOPOLOGIES = {
+    'full_mesh': full_mesh,
+    'random_regular': random_regular,
+    'bitcoin': bitcoin,
+    'geographic': geographic,
+    'small_world': small_world
+}
+
+
+def build_topology(config: dict, n: int, rng, location_ids=None, latencies=None):
+    """Builds the topology described in `config` (e.g. ``{'name': 'random_regular', 'degree': 8}``)
+    for `n` nodes, with the random choices taken from `rng`. The location of each node
+    (`location_ids`) and the `latencies` between the locations are only used by the
+    ``geographic`` topology. A parameter unknown to the topology raises a `TypeError`.
+
+    The random topologies are built again until all the nodes are connected, a node that
+    cannot be reached would never receive a block."""
+    config = dict(config)
+    name = config.pop('name', 'full_mesh')
+    if name not in TOPOLOGIES:
+        raise ValueError(f'Unknown topology {name}, available: {list(TOPOLOGIES)}')
+    if name == 'geographic':
+        config.update(location_ids=location_ids, latencies=latencies)
+    for _ in range(MAX_CONNECTED_ATTEMPTS):
+        topology = TOPOLOGIES[name](n, rng, **config)
+        if topology.is_connected():
+            return topology
+    raise RuntimeError(
+        f'Could not build a connected {name} topology with {n} nodes in {MAX_CONNECTED_ATTEMPTS} attempts, '
+        f'with the parameters {config}')
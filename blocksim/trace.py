@@ -0,0 +1,134 @@
+import os
+import numpy as np
+from blocksim.models.identity import object_id
+from blocksim.models.message import NetworkMessage, TRANSACTIONS, TX, NEW_BLOCKS, BLOCK_BODIES, BLOCK_HEADERS, \
+    INV, GETDATA, GET_BLOCK_BODIES, BLOCK, NOTFOUND
+
+# Layout of each record of a trace file. The records are packed, without padding, so each
+# one takes exactly `TRACE_DTYPE.itemsize` bytes
+TRACE_DTYPE = np.dtype([
+    ('time', '<f8'),
+    ('event', 'u1'),
+    ('origin', '<i4'),
+    ('destination', '<i4'),
+    ('msg_type', 'u1'),
+    ('object_id', '<u8'),
+    ('size', '<f4')
+])
+
+# Event types
+SEND = 1
+BROADCAST = 2
+RECEIVE = 3
+ADD_BLOCK = 4
+EVENTS = {
+    SEND: 'send',
+    BROADCAST: 'broadcast',
+    RECEIVE: 'receive',
+    ADD_BLOCK: 'add_block'
+}
+
+# Number of records kept in memory before being written to the file
+DEFAULT_TRACE_BUFFER = 65536
+
+NO_NODE = -1
+
+
+def _message_objects(msg: NetworkMessage):
+    """Returns the ids of the blocks or transactions carried by a message"""
+    code = msg.code
+    if code == TRANSACTIONS:
+        return msg.transactions.ids
+    if code == TX:
+        return msg.tx.ids
+    if code == NEW_BLOCKS:
+        return [object_id(h) for h in msg.new_blocks]
+    if code == BLOCK_BODIES:
+        return [object_id(h) for h in msg.block_bodies]
+    if code == BLOCK_HEADERS:
+        return [object_id(header.hash) for header in msg.block_headers]
+    if code in (INV, GETDATA, GET_BLOCK_BODIES, NOTFOUND):
+        return [object_id(h) for h in msg.hashes]
+    if code == BLOCK:
+        return [object_id(msg.block.header.hash)]
+    return [0]
+
+
+class TraceWriter:
+    """Writes the events of a simulation to an append-only binary file, as fixed width
+    records with the layout of `TRACE_DTYPE`.
+
+    A message carrying several blocks or transactions is written as one record per object,
+    all of them with the same time, nodes, message type and size (the size of the whole
+    message). Nodes are identified by their `node_id`.
+
+    The records are buffered in memory and appended to the file each time the buffer is full,
+    and when the writer is closed. The file can be read with `read_trace`.
+
+    :param str path: the file where the trace is written, it is replaced if it exists
+    :param int buffer_size: the number of records kept in memory before being written
+    """
+
+    def __init__(self, path: str, buffer_size=DEFAULT_TRACE_BUFFER):
+        if buffer_size < 1:
+            raise ValueError(f'The trace buffer size must be positive, got {buffer_size}')
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._file = open(path, 'wb')
+        self._buffer = np.zeros(buffer_size, dtype=TRACE_DTYPE)
+        self._position = 0
+
+    def message(self, now: float, event: int, origin: int, destination: int, msg: NetworkMessage):
+        """Records a message `event` (`SEND`, `BROADCAST` or `RECEIVE`). The message type is
+        recorded with its code from `MESSAGE_CODES`, code 0 is used for events without a
+        message (e.g. `ADD_BLOCK`)"""
+        self.record(now, event, origin, destination, msg.code, _message_objects(msg), msg.size)
+
+    def add_block(self, now: float, node: int, block_hash):
+        self.record(now, ADD_BLOCK, node, NO_NODE, 0, [object_id(block_hash)], 0.0)
+
+    def record(self, now: float, event: int, origin: int, destination: int, msg_type: int,
+               object_ids, size: float):
+        """Appends one record for each id in `object_ids`"""
+        n = len(object_ids)
+        if self._position + n > len(self._buffer):
+            self.flush()
+            if n > len(self._buffer):
+                self._buffer = np.zeros(n, dtype=TRACE_DTYPE)
+        records = self._buffer[self._position:self._position + n]
+        records['time'] = now
+        records['event'] = event
+        records['origin'] = origin
+        records['destination'] = destination
+        records['msg_type'] = msg_type
+        records['object_id'] = object_ids
+        records['size'] = size
+        self._position += n
+
+    def flush(self):
+        if self._position:
+            self._file.write(self._buffer[:self._position].tobytes())
+            self._position = 0
+        self._file.flush()
+
+    def close(self):
+        if not self._file.closed:
+            self.flush()
+            self._file.close()
+
+    def discard(self):
+        """Closes the writer without writing the records buffered, and removes the file"""
+        if not self._file.closed:
+            self._file.close()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+def read_trace(path: str):
+    """Memory maps a trace file written by `TraceWriter` as a NumPy structured array, so
+    the records are only read from disk when they are accessed"""
+    if os.path.getsize(path) == 0:
+        return np.zeros(0, dtype=TRACE_DTYPE)
+    return np.memmap(path, dtype=TRACE_DTYPE, mode='r')
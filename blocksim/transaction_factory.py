@@ -1,7 +1,5 @@
-import string
-from random import randint, choices
-from blocksim.models.transaction import Transaction
-from blocksim.models.ethereum.transaction import Transaction as ETHTransaction
+from random import randint
+from blocksim.models.transaction_batch import TransactionBatch
 
 
 class TransactionFactory:
@@ -10,6 +8,8 @@ class TransactionFactory:
     transaction model. Moreover, the created transactions will be broadcasted when simulation
     is running by a random node on a list. Additionally, the user needs to specify the
     number of batches, number of transactions per batch and the interval in seconds between each batch.
+
+    Each batch is created as a single `TransactionBatch`, instead of one object per transaction.
     """
 
     def __init__(self, world):
@@ -17,18 +17,15 @@ class TransactionFactory:
 
     def broadcast(self, number_of_batches, transactions_per_batch, interval, nodes_list):
         for i in range(number_of_batches):
-            transactions = []
-            for _i in range(transactions_per_batch):
-                # Generate a random string to a transaction be distinct from others
-                rand_sign = ''.join(
-                    choices(string.ascii_letters + string.digits, k=20))
-                if self._world.blockchain == 'bitcoin':
-                    tx = Transaction('address', 'address', 140, rand_sign, 50)
-                elif self._world.blockchain == 'ethereum':
-                    gas_limit = self._world.env.config['ethereum']['tx_gas_limit']
-                    tx = ETHTransaction('address', 'address',
-                                        140, rand_sign, i, 2, gas_limit)
-                transactions.append(tx)
+            now = self._world.env.now
+            if self._world.blockchain == 'bitcoin':
+                transactions = TransactionBatch.create(
+                    transactions_per_batch, now, fee=50)
+            elif self._world.blockchain == 'ethereum':
+                gas_limit = self._world.env.config['ethereum']['tx_gas_limit']
+                gasprice = 2
+                transactions = TransactionBatch.create(
+                    transactions_per_batch, now, fee=gasprice * gas_limit, gasprice=gasprice, startgas=gas_limit)
             self._world.env.data['created_transactions'] += len(transactions)
             # Choose a random node to broadcast the transaction
             self._world.env.process(
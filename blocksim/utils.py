@@ -3,6 +3,8 @@ from datetime import datetime
 import random
 from ast import literal_eval as make_tuple
 import scipy.stats
+import numpy as np
+from blocksim.distribution import Distribution
 try:
     from Crypto.Hash import keccak
 
@@ -15,80 +17,131 @@ except ImportError:
         return _sha3.keccak_256(value).digest()
 
 
-def get_latency_delay(env, origin: str, destination: str, n=1):
-    distribution = env.delays['LATENCIES'][origin][destination]
-    # Convert latency in ms to seconds
-    latencies = [
-        latency/1000 for latency in get_random_values(distribution, n)]
-    if len(latencies) == 1:
-        return round(latencies[0], 4)
-    else:
-        return latencies
+def get_latency_delay(env, origin: int, destination: int, n=1):
+    """
+    It returns the latency in seconds between two locations
+
+    :param origin: the location id of the origin node
+    :param destination: the location id of the destination node
+    :param n: the number of delays returned
+
+    If `n` is 1 it returns a `float`, if `n > 1` returns an array of `n` floats.
+    """
+    pool = env.delays['LATENCIES'][origin, destination]
+    if n == 1:
+        return pool.get()
+    return pool.take(n)
+
+
+def get_latency_delays(env, origin: int, destinations):
+    """
+    It returns an array with the latency in seconds from the `origin` location to
+    each location id in `destinations`
+    """
+    return env.delays['LATENCIES'].sample(origin, destinations)
 
 
-def get_received_delay(env, message_size: float, origin: str, destination: str, n=1):
+def get_received_delay(env, message_size: float, origin: int, destination: int, n=1):
     """
     It calculates and returns a delay when receiving/downloading a message with a certain size (`message_size`)
 
     :param message_size: message size in megabytes (MB)
-    :param origin: the location of the origin node
-    :param destination: the location of the destination node
+    :param origin: the location id of the origin node
+    :param destination: the location id of the destination node
     :param n: the number of delays returned
 
     If `n` is 1 it returns a `float`, if `n > 1` returns an array of `n` floats.
     """
-    distribution = env.delays['THROUGHPUT_RECEIVED'][origin][destination]
-    delay = _calc_throughput(distribution, message_size, n)
-    if delay < 0:
+    pool = env.delays['THROUGHPUT_RECEIVED'][origin, destination]
+    delay = _calc_throughput(pool, message_size, n)
+    if np.min(delay) < 0:
         raise RuntimeError(
             f'Negative received delay ({delay}) to origin {origin} and destination {destination}')
     else:
         return delay
 
 
-def get_sent_delay(env, message_size: float, origin: str, destination: str, n=1):
+def get_sent_delay(env, message_size: float, origin: int, destination: int, n=1):
     """
     It calculates and returns a delay when sending/uploading a message with a certain size (`message_size`)
 
     :param message_size: message size in megabytes (MB)
-    :param origin: the location of the origin node
-    :param destination: the location of the destination node
+    :param origin: the location id of the origin node
+    :param destination: the location id of the destination node
     :param n: the number of delays returned
 
     If `n` is 1 it returns a `float`, if `n > 1` returns an array of `n` floats.
     """
-    distribution = env.delays['THROUGHPUT_SENT'][origin][destination]
-    delay = _calc_throughput(distribution, message_size, n)
-    if delay < 0:
+    pool = env.delays['THROUGHPUT_SENT'][origin, destination]
+    delay = _calc_throughput(pool, message_size, n)
+    if np.min(delay) < 0:
         raise RuntimeError(
             f'Negative sent delay ({delay}) to origin {origin} and destination {destination}')
     else:
         return delay
 
 
-def _calc_throughput(distribution: dict, message_size: float, n):
-    rand_throughputs = get_random_values(distribution, n)
-    delays = []
-    for throughput in rand_throughputs:
-        delay = (message_size * 8) / throughput
-        delays.append(delay)
-    if len(delays) == 1:
-        return round(delays[0], 3)
-    else:
-        return delays
+def get_sent_delays(env, message_size: float, origin: int, destinations):
+    """
+    It returns an array with the delay when sending/uploading a message with a certain
+    size (`message_size`) from the `origin` location to each location id in `destinations`
+    """
+    delays = np.round(
+        message_size * env.delays['THROUGHPUT_SENT'].sample(origin, destinations), 3)
+    if len(delays) and np.min(delays) < 0:
+        raise RuntimeError(
+            f'Negative sent delay ({np.min(delays)}) to origin {origin} and destinations {destinations}')
+    return delays
+
+
+def get_concurrent_sent_delays(delays):
+    """
+    It receives the `delays` needed to upload a message to each destination with the full
+    bandwidth of the uplink, and returns the delay until each upload ends when all of them
+    start at the same time and share the bandwidth equally (processor sharing).
+
+    The i-th shortest upload ends after the ones shorter than it, plus its own delay
+    multiplied by the number of uploads still running: ``sum(d[:i]) + (k - i) * d[i]``
+    """
+    delays = np.asarray(delays, dtype=np.float64)
+    order = np.argsort(delays, kind='stable')
+    sorted_delays = delays[order]
+    k = len(delays)
+    ends = np.cumsum(sorted_delays) - sorted_delays + (k - np.arange(k)) * sorted_delays
+    concurrent_delays = np.empty(k)
+    concurrent_delays[order] = ends
+    return concurrent_delays
+
+
+def _calc_throughput(pool, message_size: float, n):
+    """The `pool` gives the seconds needed to transmit one MB"""
+    if n == 1:
+        return round(message_size * pool.get(), 3)
+    return message_size * pool.take(n)
 
 
 def time(env):
     return datetime.utcfromtimestamp(env.now).strftime('%m-%d %H:%M:%S')
 
 
+def short_hash(value):
+    """Returns a short representation of a block or transaction hash, used in logs and reports.
+    Synthetic integer ids are represented in full."""
+    if isinstance(value, str):
+        return value[:8]
+    return str(value)
+
+
 def kB_to_MB(value):
     return value / 1000
 
 
-def get_random_values(distribution: dict, n=1):
+def get_random_values(distribution, n=1):
     """Receives a `distribution` and outputs `n` random values
-    Distribution format: { \'name\': str, \'parameters\': tuple }"""
+    The distribution can be a compiled `Distribution` or a dictionary with the format:
+    { \'name\': str, \'parameters\': tuple }"""
+    if isinstance(distribution, Distribution):
+        return distribution.rvs(n)
     dist = getattr(scipy.stats, distribution['name'])
     param = make_tuple(distribution['parameters'])
     return dist.rvs(*param[:-2], loc=param[-2], scale=param[-1], size=n)
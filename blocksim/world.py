@@ -1,7 +1,66 @@
 import json
+import random
 from datetime import datetime
 import simpy
-from schema import Schema, SchemaError
+import numpy as np
+from blocksim.distribution import DistributionRegistry, DelayMatrix, DEFAULT_BUFFER_SIZE
+from blocksim.models import identity
+from blocksim.logger import SimulationLogger
+from blocksim.trace import TraceWriter
+from blocksim.metrics import PropagationMetrics
+from blocksim.report import ReportWriter, DEFAULT_REPORT_INTERVAL, DEFAULT_CHUNK_SIZE
+from blocksim.models.network import CONNECTION_DELIVERY_MODES
+from blocksim.models.node import BROADCAST_UPLINK_MODELS
+from blocksim.models.consensus import VALIDATION_MODELS
+from blocksim.models.block_store import BLOCK_STORES
+from blocksim.models.db import DBFactory
+from blocksim.models.chain import MAX_ORPHAN_BLOCKS, ORPHAN_EXPIRY
+
+# Default values for the `simulation` section of the configuration file
+SIMULATION_DEFAULTS = {
+    'seed': None,
+    'buffer_size': DEFAULT_BUFFER_SIZE,
+    'synthetic_ids': False,
+    'log_levels': {},
+    'log_ring_buffer': 0,
+    'trace': None,
+    'propagation_metrics': 'location',
+    'propagation_records': False,
+    'report_format': 'json',
+    'report_interval': DEFAULT_REPORT_INTERVAL,
+    'report_chunk_size': DEFAULT_CHUNK_SIZE,
+    'connection_delivery': 'scheduled',
+    'broadcast_uplink': 'sequential',
+    'topology': {'name': 'full_mesh'},
+    'validation_model': 'sequential',
+    'validation_workers': 1,
+    'known_inventory': {'name': 'lru'},
+    'block_store': 'node',
+    'db': {'name': 'memory'},
+    'max_orphan_blocks': MAX_ORPHAN_BLOCKS,
+    'orphan_expiry': ORPHAN_EXPIRY,
+    'orphan_eviction': 'age',
+    'finality_depth': None,
+    'finality_spill': False
+}
+
+
+def _round_validation_delays(delays):
+    return np.round(delays, 4)
+
+
+def _round_block_intervals(intervals):
+    return np.round(intervals, 2)
+
+
+def _latencies_to_seconds(latencies):
+    # Convert latency in ms to seconds
+    return np.round(latencies / 1000, 4)
+
+
+def _throughputs_to_seconds_per_MB(throughputs):
+    # Convert the throughput in Mbit/s to the seconds needed to transmit one MB
+    return 8 / throughputs
 
 
 class SimulationWorld:
@@ -18,11 +77,76 @@ class SimulationWorld:
     Each distribution is represented as dictionary, with the following schema:
     ``{ 'name': str, 'parameters': tuple }``
 
-    We use SciPy to work with probability distributions.
+    We use SciPy to work with probability distributions. The distributions are parsed and
+    validated once, when the world is loaded, and the most used families (norm, lognorm,
+    invgamma, beta and expon) are sampled directly with NumPy.
 
     You can see a complete list of distributions here:
     https://docs.scipy.org/doc/scipy/reference/stats.html
 
+    The ``simulation`` section of the configuration file accepts the following options:
+
+    :param int seed: seed for all the random values drawn in the simulation (default: None)
+    :param int buffer_size: number of random values pre-drawn at once for each distribution (default: 65536)
+    :param bool synthetic_ids: identify blocks and transactions with integers from a global counter,
+        instead of Keccak 256 hashes (default: False)
+    :param dict log_levels: the log level of each subsystem (network, chain, mempool and consensus),
+        one of DEBUG, INFO, WARNING, ERROR or OFF (default: INFO for all)
+    :param int log_ring_buffer: number of last log events, of any level, kept in memory and dumped
+        if the simulation crashes (default: 0, disabled)
+    :param str trace: file where a binary trace of every message sent, broadcast and received, and of
+        every block added to a chain, is written. It can be read with ``blocksim.trace.read_trace``
+        (default: None, disabled)
+    :param str propagation_metrics: group the propagation times of transactions and blocks in
+        histograms by pair of locations (``location``) or by link between two nodes (``link``)
+        (default: location)
+    :param bool propagation_records: also write the propagation time of every transaction and block
+        on every link to the report (default: False)
+    :param str report_format: ``json`` to write the whole report at the end of the simulation to
+        ``output/report.json``, or ``ndjson`` (gzip) and ``npz`` to write it in shards to
+        ``output/report/`` while the simulation runs, together with snapshots of the propagation
+        metrics and of the chain of each node (default: json)
+    :param float report_interval: simulation seconds between each sample of the counters and each
+        write of the shards (default: 60)
+    :param int report_chunk_size: maximum number of records of each shard (default: 10000)
+    :param str connection_delivery: how the connections deliver the messages after the latency
+        delay, ``scheduled`` as a single event for each message, or ``process`` with a SimPy
+        process for each message (default: scheduled)
+    :param str broadcast_uplink: how a node uploads a message broadcast to its peers, ``sequential``
+        to upload it to one peer after the other, or ``concurrent`` to upload it to all the peers at
+        the same time, sharing the bandwidth (default: sequential)
+    :param dict topology: how the nodes are connected, with the ``name`` of the topology and its
+        parameters: ``full_mesh``, ``random_regular`` (degree), ``bitcoin`` (outbound, max_inbound),
+        ``geographic`` (degree) or ``small_world`` (neighbors, rewiring)
+        (default: ``{'name': 'full_mesh'}``)
+    :param str validation_model: how the items of a message are validated, ``sequential`` to
+        validate one after the other, or ``parallel`` to split them between the validation workers
+        (default: sequential)
+    :param int validation_workers: the number of items validated at the same time with the
+        ``parallel`` validation model (default: 1)
+    :param dict known_inventory: how each node remembers the blocks and transactions known by its
+        peers, with the ``name`` of the structure and its parameters: ``lru``, ``bloom``
+        (false_positive_rate) or ``bitset``, one bit for each block or transaction of the network
+        (default: ``{'name': 'lru'}``)
+    :param str block_store: where the blocks are stored, ``node`` for a store in each node, or
+        ``shared`` for a single store shared by the chains of all the nodes (default: node)
+    :param dict db: where the blocks are kept, with the ``name`` of the backend and its parameters:
+        ``memory`` or ``sqlite`` (path, overwrite, cache_size, batch_size), to keep them in a SQLite
+        file and only the most recently used ones in memory. Without a path, a temporary file is
+        used, and an existing file is only reused with overwrite (default: ``{'name': 'memory'}``)
+    :param int max_orphan_blocks: the maximum number of blocks received before their parent kept
+        by each node (default: 100)
+    :param float orphan_expiry: the simulation seconds a block received before its parent is kept,
+        or null to keep it until it is evicted (default: 1200)
+    :param str orphan_eviction: the block evicted when a node keeps too many blocks received before
+        their parent, the oldest (``age``) or the one with the highest number (``height``)
+        (default: age)
+    :param int finality_depth: the confirmations after which a block of the canonical chain of a
+        node is final, its forks are dropped and, with a store for each node, only its header is
+        kept and it is no longer served to the peers, or null to keep every block (default: None)
+    :param bool finality_spill: write a summary of each final block of each node to the
+        ``finalized_blocks`` stream of the report (default: False)
+
     You can use the ``scripts/test-fit-distribution.py`` to find a good distribution and its parameters which fits your input data measured.
     """
 
@@ -43,19 +167,25 @@ class SimulationWorld:
         self._measured_throughput_sent = measured_throughput_sent
         # Set the SimPy Environment
         self._env = simpy.Environment(initial_time=self._initial_time)
-        self._set_configs()
-        self._set_delays()
-        self._set_latencies()
-        self._set_throughputs()
+        try:
+            self._set_configs()
+            self._set_distributions()
+            self._set_delays()
+            self._set_latencies()
+            self._set_throughputs()
+        except BaseException:
+            # Do not leave a partial trace file behind
+            if getattr(self._env, 'trace', None) is not None:
+                self._env.trace.discard()
+            self.close()
+            raise
         # Set the monitor
         end_simulation = self._initial_time + self._sim_duration
         self._env.data = {
             'start_simulation_time': datetime.utcfromtimestamp(
                 self._initial_time).strftime('%m-%d %H:%M:%S'),
             'end_simulation_time': datetime.utcfromtimestamp(end_simulation).strftime('%m-%d %H:%M:%S'),
-            'created_transactions': 0,
-            'tx_propagation': {},
-            'block_propagation': {}
+            'created_transactions': 0
         }
 
     @property
@@ -66,18 +196,96 @@ class SimulationWorld:
     def locations(self):
         return self._locations
 
+    @property
+    def location_ids(self):
+        return self._location_ids
+
     @property
     def env(self):
         return self._env
 
+    def spawn_rng(self):
+        """Returns a new NumPy `Generator`, with a random stream independent from the ones
+        used by the distributions, and derived from the seed of the simulation"""
+        return self._registry.spawn_rng()
+
     def start_simulation(self):
         end = self._initial_time + self._sim_duration
-        self._env.run(until=end)
+        self._env.report.start()
+        try:
+            self._env.run(until=end)
+        except BaseException:
+            self._env.logger.dump()
+            self._env.report.flush()
+            raise
+        finally:
+            if self._env.trace is not None:
+                self._env.trace.close()
+
+    def close(self):
+        """Releases the databases of the simulation, once the report is written or when the
+        simulation fails"""
+        databases = getattr(self._env, 'databases', None)
+        if databases is not None:
+            databases.close()
 
     def _set_configs(self):
         """Injects the different configuration variables to the environment variable to be
         used during the simulation"""
+        self._config['simulation'] = {
+            **SIMULATION_DEFAULTS, **self._config.get('simulation', {})}
         self._env.config = self._config
+        identity.use_synthetic_ids(
+            self._config['simulation']['synthetic_ids'])
+        if self._config['simulation']['connection_delivery'] not in CONNECTION_DELIVERY_MODES:
+            raise ValueError(
+                f'Unknown connection delivery mode {self._config["simulation"]["connection_delivery"]}, '
+                f'available: {CONNECTION_DELIVERY_MODES}')
+        if self._config['simulation']['broadcast_uplink'] not in BROADCAST_UPLINK_MODELS:
+            raise ValueError(
+                f'Unknown broadcast uplink model {self._config["simulation"]["broadcast_uplink"]}, '
+                f'available: {BROADCAST_UPLINK_MODELS}')
+        if self._config['simulation']['validation_model'] not in VALIDATION_MODELS:
+            raise ValueError(
+                f'Unknown validation model {self._config["simulation"]["validation_model"]}, '
+                f'available: {VALIDATION_MODELS}')
+        if self._config['simulation']['block_store'] not in BLOCK_STORES:
+            raise ValueError(
+                f'Unknown block store {self._config["simulation"]["block_store"]}, available: {BLOCK_STORES}')
+        if self._config['simulation']['validation_workers'] < 1:
+            raise ValueError(
+                f'The validation workers must be at least 1, got {self._config["simulation"]["validation_workers"]}')
+        finality_depth = self._config['simulation']['finality_depth']
+        if finality_depth is not None and finality_depth < 1:
+            raise ValueError(f'The finality depth must be at least 1, got {finality_depth}')
+        self._env.logger = SimulationLogger(
+            self._env,
+            self._config['simulation']['log_levels'],
+            self._config['simulation']['log_ring_buffer'])
+        self._env.databases = DBFactory(**self._config['simulation']['db'])
+        self._env.report = ReportWriter(
+            self._env,
+            fmt=self._config['simulation']['report_format'],
+            interval=self._config['simulation']['report_interval'],
+            chunk_size=self._config['simulation']['report_chunk_size'])
+        self._env.metrics = PropagationMetrics(
+            self._config['simulation']['propagation_metrics'],
+            self._config['simulation']['propagation_records'],
+            self._env.report)
+        self._env.report.add_snapshot('propagation', self._env.metrics.report)
+        # The trace file is opened last, once the rest of the configuration is valid
+        trace = self._config['simulation']['trace']
+        self._env.trace = TraceWriter(trace) if trace else None
+
+    def _set_distributions(self):
+        """Creates the registry used to compile the probability distributions given as input.
+        The same `seed` is also given to the Python `random` module."""
+        seed = self._env.config['simulation']['seed']
+        if seed is not None:
+            random.seed(seed)
+        self._registry = DistributionRegistry(
+            seed, self._env.config['simulation']['buffer_size'])
+        self._env.rng = self._registry.rng
 
     def _set_delays(self):
         """Injects the probability distribution delays in the environment variable to be
@@ -89,24 +297,54 @@ class SimulationWorld:
         return blockchain_switcher.get(self.blockchain, lambda: "Invalid blockchain")()
 
     def _set_bitcoin_delays(self):
-        self._validate_distribution(
-            self._measured_delays['bitcoin']['tx_validation'],
-            self._measured_delays['bitcoin']['block_validation'],
-            self._measured_delays['bitcoin']['time_between_blocks_seconds'])
-        self._env.delays = self._measured_delays['bitcoin']
+        bitcoin_config = self._env.config['bitcoin']
+        bitcoin_config['number_transactions_per_block'] = self._registry.compile(
+            bitcoin_config['number_transactions_per_block'])
+        self._env.delays = self._compile_delays(self._measured_delays['bitcoin'])
+        # The delays between the trickles of transactions announcements to a peer
+        trickle_interval = bitcoin_config.get('inv_trickle_interval', 0)
+        if trickle_interval > 0:
+            self._env.delays['inv_trickle'] = self._registry.pool(
+                {'name': 'expon', 'parameters': f'(0, {trickle_interval})'})
 
     def _set_ethereum_delays(self):
-        self._validate_distribution(
-            self._measured_delays['ethereum']['tx_validation'],
-            self._measured_delays['ethereum']['block_validation'],
-            self._measured_delays['ethereum']['time_between_blocks_seconds'])
-        self._env.delays = self._measured_delays['ethereum']
+        self._env.delays = self._compile_delays(self._measured_delays['ethereum'])
+
+    def _compile_delays(self, delays: dict):
+        return {
+            'tx_validation': self._registry.pool(
+                delays['tx_validation'], _round_validation_delays),
+            'block_validation': self._registry.pool(
+                delays['block_validation'], _round_validation_delays),
+            'time_between_blocks_seconds': self._registry.pool(
+                delays['time_between_blocks_seconds'], _round_block_intervals)
+        }
+
+    def _compile_locations(self, locations: dict, transform):
+        """Compiles the distributions measured between each pair of locations into a
+        `DelayMatrix` indexed by the location ids"""
+        pools = []
+        for origin in self.locations:
+            row = []
+            for destination in self.locations:
+                try:
+                    distribution = locations[origin][destination]
+                except KeyError:
+                    raise RuntimeError(
+                        f'There are not measurements from {origin} to {destination}')
+                row.append(self._registry.pool(distribution, transform))
+            pools.append(row)
+        return DelayMatrix(self.locations, pools)
 
     def _set_latencies(self):
         """Reads the file with the latencies measurements taken"""
         data = self._read_json_file(self._measured_latency)
         self._locations = list(data['locations'])
-        self._env.delays.update(dict(LATENCIES=data['locations']))
+        self._location_ids = {
+            location: location_id for location_id, location in enumerate(self._locations)}
+        self._env.location_ids = self._location_ids
+        self._env.delays.update(
+            dict(LATENCIES=self._compile_locations(data['locations'], _latencies_to_seconds)))
 
     def _set_throughputs(self):
         """Reads the measured throughputs and pass it to the environment variable to be
@@ -122,22 +360,12 @@ class SimulationWorld:
                 "The locations in latencies measurements are not equal in throughputs measurements")
         # Pass the throughputs to the environment variable
         self._env.delays.update(dict(
-            THROUGHPUT_RECEIVED=throughput_received['locations'],
-            THROUGHPUT_SENT=throughput_sent['locations']
+            THROUGHPUT_RECEIVED=self._compile_locations(
+                throughput_received['locations'], _throughputs_to_seconds_per_MB),
+            THROUGHPUT_SENT=self._compile_locations(
+                throughput_sent['locations'], _throughputs_to_seconds_per_MB)
         ))
 
-    def _validate_distribution(self, *distributions: dict):
-        for distribution in distributions:
-            distribution_schema = Schema({
-                'name': str,
-                'parameters': str
-            })
-            try:
-                distribution_schema.validate(distribution)
-            except SchemaError:
-                raise TypeError(
-                    'Probability distribution must follow this schema: { \'name\': str, \'parameters\': tuple as a string }')
-
     def _read_json_file(self, file_location):
         with open(file_location) as f:
             return json.load(f)
@@ -0,0 +1,84 @@
+"""Checks that the nodes of a simulation with a sparse topology agree on the chain.
+
+Runs a simulation with the configuration of ``input-parameters``, replacing its topology,
+and fails if any node ends more than ``--max-lag`` blocks behind the highest one.
+
+Usage (from the root of the repository):
+    python scripts/check_convergence.py --blockchain ethereum --nodes 60 \
+        --topology '{"name": "random_regular", "degree": 6}'
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from blocksim.world import SimulationWorld  # noqa: E402
+from blocksim.node_factory import NodeFactory  # noqa: E402
+from blocksim.transaction_factory import TransactionFactory  # noqa: E402
+from blocksim.models.network import Network  # noqa: E402
+
+INPUT = 'input-parameters'
+
+
+def run(blockchain: str, topology: dict, nodes: int, duration: int, seed: int):
+    with open(os.path.join(INPUT, 'config.json')) as f:
+        config = json.load(f)
+    config['blockchain'] = blockchain
+    config['simulation'] = {
+        **config.get('simulation', {}),
+        'seed': seed,
+        'topology': topology,
+        'log_levels': {'network': 'OFF', 'chain': 'OFF', 'mempool': 'OFF', 'consensus': 'OFF'}
+    }
+    with tempfile.TemporaryDirectory() as directory:
+        config_file = os.path.join(directory, 'config.json')
+        with open(config_file, 'w') as f:
+            json.dump(config, f)
+        world = SimulationWorld(
+            duration,
+            0,
+            config_file,
+            os.path.join(INPUT, 'latency.json'),
+            os.path.join(INPUT, 'throughput-received.json'),
+            os.path.join(INPUT, 'throughput-sent.json'),
+            os.path.join(INPUT, 'delays.json'))
+        network = Network(world.env, 'NetworkXPTO')
+        non_miners = nodes - 3
+        node_factory = NodeFactory(world, network)
+        nodes_list = node_factory.create_nodes(
+            {'Tokyo': {'how_many': 3, 'mega_hashrate_range': '(20, 40)'}},
+            {'Tokyo': {'how_many': non_miners // 2}, 'Ireland': {'how_many': non_miners - non_miners // 2}})
+        world.env.process(network.start_heartbeat())
+        node_factory.connect_nodes(nodes_list)
+        TransactionFactory(world).broadcast(100, 400, 15, nodes_list)
+        try:
+            world.start_simulation()
+        finally:
+            world.close()
+    return {node.address: node.chain.height for node in nodes_list}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--blockchain', default='ethereum')
+    parser.add_argument('--topology', default='{"name": "random_regular", "degree": 6}', type=json.loads)
+    parser.add_argument('--nodes', default=60, type=int)
+    parser.add_argument('--duration', default=1200, type=int)
+    parser.add_argument('--seed', default=7, type=int)
+    parser.add_argument('--max-lag', default=2, type=int)
+    args = parser.parse_args()
+    heights = run(args.blockchain, args.topology, args.nodes, args.duration, args.seed)
+    highest = max(heights.values())
+    behind = {address: height for address, height in heights.items() if highest - height > args.max_lag}
+    print(f'{len(heights)} nodes, highest block #{highest}, {len(behind)} more than {args.max_lag} blocks behind')
+    if highest < 1 or behind:
+        for address, height in sorted(behind.items()):
+            print(f'  {address} #{height}')
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -11,6 +11,7 @@ setup(
         'simpy',
         'schema',
         'scipy',
+        'numpy>=1.17',
         'pysha3'
     ],
     author='Carlos Faria',